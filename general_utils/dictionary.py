@@ -1,12 +1,65 @@
 def dictionaries_intersect(*dictionaries):
     """
     Returns True if any dictionaries passed share keys, otherwise returns False
+
+    Stops at the first shared key found (see iter_key_collisions)
     """
     if len(dictionaries) <= 1:
         raise ValueError(f"Invalid input.  Got {len(dictionaries)} dictionaries - must specify at least 2")
-    total_count = 0
-    keys = set()
-    for d in dictionaries:
-        total_count += len(d)
-        keys.update(list(d.keys()))
-    return not (len(keys) == total_count)
\ No newline at end of file
+    return next(iter_key_collisions(dictionaries), None) is not None
+
+
+def iter_key_collisions(dictionaries):
+    """
+    Lazily yields every key that is found in more than one of the dictionaries
+
+    Keys are read from each dictionary's key view without being copied, and collisions are yielded as soon as they are
+    found, so stopping after the first one (eg with next()) stops the search.  dictionaries may be any iterable,
+    including a generator, so mappings can be streamed through without all being held at once.  Only the keys seen so
+    far (and the index of the dictionary each was first seen in) are kept in memory.
+
+    Args:
+        dictionaries (iterable): Iterable of dicts (or any mappings)
+
+    Yields:
+        (tuple): (key, first_index, index), where first_index is the position in dictionaries of the first dictionary
+                 the key was found in and index is the position of the dictionary it was found in again
+    """
+    if isinstance(dictionaries, (list, tuple)) and len(dictionaries) == 2:
+        # For a pair, look up the keys of the smaller dictionary in the larger one without tracking seen keys
+        if len(dictionaries[0]) <= len(dictionaries[1]):
+            for key in dictionaries[0].keys():
+                if key in dictionaries[1]:
+                    yield key, 0, 1
+        else:
+            for key in dictionaries[1].keys():
+                if key in dictionaries[0]:
+                    yield key, 0, 1
+        return
+
+    first_seen = {}
+    for index, d in enumerate(dictionaries):
+        for key in d.keys():
+            first_index = first_seen.setdefault(key, index)
+            if first_index != index:
+                yield key, first_index, index
+
+
+def find_key_collisions(dictionaries, first_only=False):
+    """
+    Returns the keys that are found in more than one of the dictionaries, and which dictionaries they were found in
+
+    Args:
+        dictionaries (iterable): Iterable of dicts (or any mappings).  May be a generator (see iter_key_collisions)
+        first_only (bool): If True, stop searching after the first collision found
+
+    Returns:
+        (dict): Dict of {key: indices} for each key found in more than one dictionary, where indices is a list of the
+                positions in dictionaries of every dictionary the key was found in.  Empty if no keys collide
+    """
+    collisions = {}
+    for key, first_index, index in iter_key_collisions(dictionaries):
+        collisions.setdefault(key, [first_index]).append(index)
+        if first_only:
+            break
+    return collisions
@@ -1,23 +1,180 @@
+import collections
+import concurrent.futures
+import fractions
+import os
 import numpy as np
-import math
+import pandas as pd
 
 
-def polar_to_cart(r, theta, unit='deg'):
+def polar_to_cart(r, theta, unit='deg', out=None):
+    """
+    Converts polar coordinates to cartesian coordinates
+
+    Args:
+        r (float or np.array): Radius
+        theta (float or np.array): Angle, in units of unit
+        unit (str): Unit of theta, either 'deg' or 'rad'
+        out (tuple): (OPTIONAL) Tuple of (x, y) arrays to write the results into.  When given, no temporary arrays are
+                     allocated and the results have the dtype of the out arrays.  The out arrays must not share memory
+                     with r or theta
+
+    Returns:
+        Tuple of:
+            (float or np.array): x
+            (float or np.array): y
+    """
+    if out is None:
+        if unit == 'deg':
+            theta = np.deg2rad(theta)
+        x = r * np.cos(theta)
+        y = r * np.sin(theta)
+        return x, y
+
+    x, y = out
     if unit == 'deg':
-        theta = np.deg2rad(theta)
-    x = r * np.cos(theta)
-    y = r * np.sin(theta)
+        # Use y as scratch space for the angle in radians
+        np.deg2rad(theta, out=y)
+        np.cos(y, out=x)
+        np.sin(y, out=y)
+    else:
+        np.cos(theta, out=x)
+        np.sin(theta, out=y)
+    np.multiply(x, r, out=x)
+    np.multiply(y, r, out=y)
     return x, y
 
 
-def cart_to_polar(x, y, unit='deg'):
-    r = np.sqrt(x**2 + y**2)
-    theta = np.arctan2(y, x)
+def cart_to_polar(x, y, unit='deg', out=None):
+    """
+    Converts cartesian coordinates to polar coordinates
+
+    Args:
+        x (float or np.array): x
+        y (float or np.array): y
+        unit (str): Unit of the returned theta, either 'deg' or 'rad'
+        out (tuple): (OPTIONAL) Tuple of (r, theta) arrays to write the results into.  When given, no temporary arrays
+                     are allocated and the results have the dtype of the out arrays.  The out arrays must not share
+                     memory with x or y
+
+    Returns:
+        Tuple of:
+            (float or np.array): r
+            (float or np.array): theta
+    """
+    if out is None:
+        r = np.hypot(x, y)
+        theta = np.arctan2(y, x)
+    else:
+        r, theta = out
+        np.hypot(x, y, out=r)
+        np.arctan2(y, x, out=theta)
     if unit == 'deg':
-        theta = np.rad2deg(theta)
+        theta = np.rad2deg(theta, out=None if out is None else theta)
     return r, theta
 
 
+def polar_to_cart_chunked(r, theta, unit='deg', out=None, dtype=None, chunk_size=2**20, n_workers=1):
+    """
+    Converts polar coordinates to cartesian coordinates in bounded memory by processing the inputs in chunks
+
+    Inputs and outputs may be memory-mapped .npy files, so arrays larger than memory can be streamed from and to disk.
+
+    Args:
+        r (float, np.array or str): Radius, or the path to a .npy file of radii (which is opened memory-mapped)
+        theta (float, np.array or str): Angle in units of unit, or the path to a .npy file of angles
+        unit (str): Unit of theta, either 'deg' or 'rad'
+        out (tuple): (OPTIONAL) Tuple of (x, y) outputs, each either an array (including a np.memmap) or the path of a
+                     .npy file to create as a memory-mapped array.  If None, in-memory arrays are allocated
+        dtype: (OPTIONAL) dtype of outputs that are allocated here.  If None, inputs of float32 give float32 outputs
+               and anything else gives float64
+        chunk_size (int): Number of elements (along the first axis) processed at a time
+        n_workers (int): Number of threads to process chunks with.  If None, uses one per CPU
+
+    Returns:
+        Tuple of:
+            (np.array): x
+            (np.array): y
+    """
+    return _transform_chunked(polar_to_cart, r, theta, unit=unit, out=out, dtype=dtype, chunk_size=chunk_size,
+                              n_workers=n_workers)
+
+
+def cart_to_polar_chunked(x, y, unit='deg', out=None, dtype=None, chunk_size=2**20, n_workers=1):
+    """
+    Converts cartesian coordinates to polar coordinates in bounded memory by processing the inputs in chunks
+
+    See polar_to_cart_chunked for details on the arguments
+
+    Returns:
+        Tuple of:
+            (np.array): r
+            (np.array): theta
+    """
+    return _transform_chunked(cart_to_polar, x, y, unit=unit, out=out, dtype=dtype, chunk_size=chunk_size,
+                              n_workers=n_workers)
+
+
+def _transform_chunked(transform, a, b, unit, out, dtype, chunk_size, n_workers):
+    """
+    Applies transform(a, b, unit=unit, out=out) chunk by chunk along the first axis (see polar_to_cart_chunked)
+    """
+    a = _open_npy(a)
+    b = _open_npy(b)
+    shape = np.shape(a) if np.ndim(a) else np.shape(b)
+    for arg in (a, b):
+        if np.ndim(arg) and np.shape(arg) != shape:
+            raise ValueError(f"Inputs must be scalars or have the same shape.  Got {np.shape(a)} and {np.shape(b)}")
+    if dtype is None:
+        # Only array inputs decide the dtype, so a Python scalar (a float64) does not promote float32 arrays
+        dtypes = [np.asarray(arg).dtype for arg in (a, b) if np.ndim(arg)] or [np.asarray(a).dtype, np.asarray(b).dtype]
+        dtype = np.result_type(*dtypes, np.float32)
+
+    if out is None:
+        out = (None, None)
+    out = tuple(_create_npy(o, shape=shape, dtype=dtype) for o in out)
+
+    def transform_chunk(chunk):
+        transform(a[chunk] if np.ndim(a) else a, b[chunk] if np.ndim(b) else b, unit=unit,
+                  out=(out[0][chunk], out[1][chunk]))
+
+    n = shape[0] if shape else 1
+    chunks = [slice(start, start + chunk_size) for start in range(0, n, chunk_size)] if shape else [Ellipsis]
+    if n_workers == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            transform_chunk(chunk)
+    else:
+        # NumPy ufuncs release the GIL, so threads process chunks in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(transform_chunk, chunks))
+
+    for o in out:
+        if isinstance(o, np.memmap):
+            o.flush()
+    return out
+
+
+def _open_npy(a):
+    """
+    Returns a memory-mapped, read-only array if a is the path to a .npy file, otherwise returns a unchanged
+    """
+    if isinstance(a, (str, os.PathLike)):
+        return np.load(a, mmap_mode='r')
+    return a
+
+
+def _create_npy(a, shape, dtype):
+    """
+    Returns a new memory-mapped .npy file if a is a path, a new in-memory array if a is None, otherwise a unchanged
+    """
+    if a is None:
+        return np.empty(shape, dtype=dtype)
+    elif isinstance(a, (str, os.PathLike)):
+        return np.lib.format.open_memmap(a, mode='w+', dtype=dtype, shape=shape)
+    elif np.shape(a) != shape:
+        raise ValueError(f"out arrays must have shape {shape}.  Got {np.shape(a)}")
+    return a
+
+
 def floor_to(x, to_value=0.05):
     """
     Floors x to the nearest multiple of to_value
@@ -25,29 +182,151 @@ def floor_to(x, to_value=0.05):
     For example, floor_to(1.27, 0.05) evaluates to 1.25
 
     Args:
-        x (float): Value to floor
+        x (float, int, np.array or pd.Series): Value to floor
         to_value (float): Value to floor to a multiple of
 
     Returns:
-        (float)
+        (float, int, np.array or pd.Series): Integer if x and to_value are integers, otherwise float
     """
-    return x // to_value * to_value
+    return snap_to(x, to_value=to_value, how='floor')
 
 
 def ceil_to(x, to_value=0.05):
     """
     Ceils x to the nearest multiple of to_value
 
-    For example, floor_to(1.27, 0.05) evaluates to 1.30
+    For example, ceil_to(1.27, 0.05) evaluates to 1.30
 
     Args:
-        x (float): Value to floor
+        x (float, int, np.array or pd.Series): Value to ceil
         to_value (float): Value to ceil to a multiple of
 
     Returns:
-        (float)
+        (float, int, np.array or pd.Series): Integer if x and to_value are integers, otherwise float
+    """
+    return snap_to(x, to_value=to_value, how='ceil')
+
+
+def snap_to(x, to_value=0.05, how='floor', return_index=False, out=None, chunk_size=2**20):
+    """
+    Snaps x to a multiple of to_value, exactly for decimal increments
+
+    Multiples of to_value are computed as n * numerator / denominator of the exact fraction to_value represents (eg
+    0.05 is treated as exactly 1/20), so snapped values are the float nearest to the true multiple.  For example,
+    snap_to(1.27, 0.1) gives 1.2 rather than 1.2000000000000002, and values already on the grid (like 1.3 with
+    to_value=0.05) are not moved by float error.  Integer x (eg int64 nanosecond timestamps) is snapped in exact
+    integer arithmetic, and the result is an int64 if to_value is an integer too.  For float32 x, grid points are
+    compared to x after rounding to float32, while the index itself is computed in float64 (where several indices
+    round to the same float32 value, the index returned is one of them).
+
+    Args:
+        x (float, int, np.array or pd.Series): Value(s) to snap.  Arrays (including memmaps) and Series are read
+                                               without being copied, in chunks of chunk_size elements along the first
+                                               axis
+        to_value (float, int, str or decimal.Decimal): Increment of the grid to snap to.  Must be positive
+        how (str): One of:
+                        floor: Snap to the largest multiple of to_value <= x
+                        ceil: Snap to the smallest multiple of to_value >= x
+                        round: Snap to the nearest multiple of to_value, with halves rounded up (towards +infinity)
+        return_index (bool): If True, return the integer index n of the multiple n * to_value instead of its value.
+                             x must not contain NaN, as NaN has no integer index
+        out (np.array): (OPTIONAL) Array to write the results into
+        chunk_size (int): Number of elements processed at a time, bounding the size of temporary arrays
+
+    Returns:
+        (float, int, np.array or pd.Series): Snapped values (or indices), as a Series with the same index if x is a
+                                             Series
+    """
+    if how not in ('floor', 'ceil', 'round'):
+        raise ValueError(f"Invalid how {how}")
+    numerator, denominator = fractions.Fraction(str(to_value)).as_integer_ratio()
+    if numerator <= 0:
+        raise ValueError(f"to_value must be positive.  Got {to_value}")
+
+    values = np.asarray(x)
+    is_integer = values.dtype.kind in 'iu'
+    # Integer results are only returned when both x and to_value are integers, as for x // to_value * to_value
+    integer_result = is_integer and isinstance(to_value, (int, np.integer))
+    if out is None:
+        if return_index:
+            dtype = np.int64
+        elif integer_result:
+            # Snapping can leave the range of small integer dtypes (eg ceil of uint8 255 to a multiple of 2)
+            dtype = np.int64
+        else:
+            dtype = np.promote_types(values.dtype, np.float32)
+        out = np.empty(values.shape, dtype=dtype)
+
+    snap_chunk = _snap_integer_chunk if is_integer else _snap_chunk
+    if values.ndim == 0:
+        out[()] = snap_chunk(values.reshape(1), numerator, denominator, how, return_index)[0]
+    else:
+        for start in range(0, len(values), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            out[chunk] = snap_chunk(values[chunk], numerator, denominator, how, return_index)
+
+    if isinstance(x, pd.Series):
+        return pd.Series(out, index=x.index, name=x.name)
+    elif values.ndim == 0:
+        return out[()]
+    return out
+
+
+def _snap_chunk(values, numerator, denominator, how, return_index):
+    """
+    Returns the grid index (or snapped value) of float values on the grid of multiples of numerator / denominator
+
+    An index is first estimated with float division and then corrected by comparing values against the grid points
+    on either side of it, rounded to the dtype of values (so values already on the grid of that dtype are not moved).
+    Indices are computed in float64 whatever the dtype of values, as float32 can't hold indices beyond 2**24
+    """
+    if return_index and np.isnan(values).any():
+        raise ValueError("x must not contain NaN when return_index=True")
+
+    def grid(index, denominator=denominator):
+        # index * numerator is an exact integer, so the division gives the float nearest to the true grid point
+        return (index * numerator / denominator).astype(values.dtype, copy=False)
+
+    index = values.astype(np.float64) / (numerator / denominator)
+    if how == 'ceil':
+        np.ceil(index, out=index)
+        index -= grid(index - 1) >= values
+        index += grid(index) < values
+    else:
+        np.floor(index, out=index)
+        index += grid(index + 1) <= values
+        index -= grid(index) > values
+        if how == 'round':
+            index += grid(2 * index + 1, denominator=2 * denominator) <= values
+
+    if return_index:
+        return index
+    return grid(index)
+
+
+def _snap_integer_chunk(values, numerator, denominator, how, return_index):
+    """
+    Returns the grid index (or snapped value) of integer values on the grid of multiples of numerator / denominator
+
+    x / to_value is split into (x // numerator) * denominator + (x % numerator) * denominator / numerator, so the index
+    is computed exactly with integer division and only the remainder is scaled (large values such as nanosecond
+    timestamps cannot overflow)
     """
-    return math.ceil(x / to_value) * to_value
+    quotient, remainder = np.divmod(values.astype(np.int64, copy=False), numerator)
+    index = quotient * denominator
+    remainder *= denominator
+    if how == 'floor':
+        index += remainder // numerator
+    elif how == 'ceil':
+        index -= -remainder // numerator
+    else:
+        index += (2 * remainder + numerator) // (2 * numerator)
+
+    if return_index:
+        return index
+    if denominator == 1:
+        return index * numerator
+    return index * numerator / denominator
 
 
 def normalized_log(x):
@@ -62,3 +341,102 @@ def normalized_log(x):
     x = np.asarray(x)
     logx = np.log(x + 1)
     return logx / logx.sum()
+
+
+class ClassWeightAccumulator:
+    def __init__(self):
+        """
+        Accumulates class counts from batches of labels so normalized_log class weights can be computed on demand
+
+        Counts are kept per group (eg per tenant or per day), and only the counts (never the raw labels) are stored, so
+        weights can be computed for data far too large to hold in memory at once and never require rescanning it.
+        """
+        # Dict of {group: Counter of {label: count}}
+        self._counts = {}
+
+    @property
+    def groups(self):
+        """
+        List of the groups that have counts
+        """
+        return list(self._counts)
+
+    def update(self, labels, group=None, groups=None):
+        """
+        Add a batch of labels to the counts
+
+        Args:
+            labels (np.array or iterable): Labels of the batch
+            group: (OPTIONAL) Group that every label in the batch belongs to
+            groups (np.array or iterable): (OPTIONAL) Group of each label, aligned with labels.  Overrides group
+
+        Returns:
+            None
+        """
+        if groups is None:
+            self.update_counts(pd.Series(labels).value_counts(sort=False), group=group)
+        else:
+            # Count each (group, label) pair by its combined integer code, so the only Python loop is over unique pairs
+            group_codes, group_uniques = pd.factorize(pd.Index(groups, tupleize_cols=False))
+            label_codes, label_uniques = pd.factorize(pd.Index(labels, tupleize_cols=False))
+            is_valid = (group_codes >= 0) & (label_codes >= 0)
+            pair_codes, pair_counts = np.unique(group_codes[is_valid] * len(label_uniques) + label_codes[is_valid],
+                                                return_counts=True)
+            for pair_code, count in zip(pair_codes.tolist(), pair_counts.tolist()):
+                group_code, label_code = divmod(pair_code, len(label_uniques))
+                self._counts.setdefault(group_uniques[group_code], collections.Counter())[label_uniques[label_code]] \
+                    += count
+
+    def update_counts(self, counts, group=None):
+        """
+        Add already-computed counts to the counts, eg a chunk of value_counts() output
+
+        Args:
+            counts (pd.Series or dict): Counts indexed (or keyed) by label
+            group: (OPTIONAL) Group that the counts belong to
+
+        Returns:
+            None
+        """
+        self._counts.setdefault(group, collections.Counter()).update(dict(counts.items()))
+
+    def merge(self, other):
+        """
+        Add the counts of another ClassWeightAccumulator (for example from a parallel worker) to this one
+
+        Returns:
+            None
+        """
+        for group, counts in other._counts.items():
+            self.update_counts(counts, group=group)
+
+    def counts(self, group=None):
+        """
+        Returns the counts of a group as a pd.Series indexed by label
+        """
+        counts = self._counts.get(group, {})
+        return pd.Series(list(counts.values()), index=list(counts.keys()), dtype=np.int64)
+
+    def weights(self, group=None):
+        """
+        Returns the normalized_log weights of a group as a pd.Series indexed by label
+        """
+        counts = self.counts(group=group)
+        return pd.Series(normalized_log(counts.values), index=counts.index)
+
+    def weights_table(self, groups=None):
+        """
+        Returns the normalized_log weights of many groups at once
+
+        Args:
+            groups (list): (OPTIONAL) Groups to return weights for.  If None, all groups are returned
+
+        Returns:
+            (pd.DataFrame): DataFrame with one row per group and one column per label.  Labels that were never seen in
+                            a group have a weight of 0
+        """
+        if groups is None:
+            groups = self.groups
+        counts = pd.DataFrame([self._counts.get(group, {}) for group in groups], index=pd.Index(groups)).fillna(0)
+        logx = np.log(counts.to_numpy(dtype=np.float64) + 1)
+        return pd.DataFrame(logx / logx.sum(axis=1, keepdims=True), index=counts.index, columns=counts.columns)
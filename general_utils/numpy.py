@@ -32,6 +32,47 @@ def safe_insert_string(a, index, val):
         raise ValueError("Array a is not a string-like numpy array")
 
 
+def safe_insert_strings(a, index, vals=None, inplace=False):
+    """
+    Returns a with a[index]=vals for many values at once, increasing the unicode length of a if necessary
+
+    This is the bulk version of safe_insert_string.  The width needed for all values is computed once, so a is copied
+    (and widened if necessary) in a single allocation before all values are scattered into it.
+
+    Args:
+        a (np.array): Array to be modified.  Should be of a string-like dtype
+        index (valid np.array index): Any type that can be used like a[index], such as an array of indices or a boolean
+                                      mask.  If vals is None, index is instead an iterable of (index, value) pairs
+        vals (iterable or str): Data to be set in array a, aligned with index (or a single value to set at every
+                                index).  Values are coerced to strings if they are not strings
+        inplace (bool): If True and a is already wide enough for every value, a is modified in place and returned
+                        without being copied.  Otherwise, a copy of a is returned
+
+    Returns:
+        (np.array): Array with a[index]=vals
+    """
+    if a.dtype.char != 'U':
+        raise ValueError("Array a is not a string-like numpy array")
+
+    if vals is None:
+        pairs = list(index)
+        vals = [val for _, val in pairs]
+        index = np.asarray([i for i, _ in pairs], dtype=np.intp)
+        if a.ndim > 1:
+            # Each index is a tuple of coordinates
+            index = tuple(index.reshape(len(pairs), a.ndim).T)
+    vals = np.asarray(vals, dtype='U')
+
+    a_length = get_length_from_unicode_dtype(a.dtype)
+    val_length = get_length_from_unicode_dtype(vals.dtype)
+    if val_length > a_length:
+        a = a.astype(f'U{val_length}')
+    elif not inplace:
+        a = a.copy()
+    a[index] = vals
+    return a
+
+
 def get_length_from_unicode_dtype(dtype):
     """
     Returns the length of a numpy unicode dtype
@@ -51,4 +92,333 @@ def get_length_from_unicode_dtype(dtype):
         return dtype.itemsize // SIZEOF_NUMPY_UNICODE_CHAR
         # return int(dtype.descr[0][1][2:])  # Old method that seems less robust but does work
     else:
-        raise ValueError("dtype must be a string-like numpy dtype")
\ No newline at end of file
+        raise ValueError("dtype must be a string-like numpy dtype")
+
+
+class StringArrayBuilder:
+    def __init__(self, capacity=16, length=1):
+        """
+        Builds a numpy unicode array one element at a time, growing the array as needed
+
+        Both the number of elements and the unicode length of the underlying buffer grow geometrically (doubling), so
+        appending is amortized O(1) instead of copying the whole array on every append or widening as repeated calls to
+        safe_insert_string would.
+
+        Args:
+            capacity (int): Number of elements to initially reserve space for
+            length (int): Unicode length to initially reserve for each element
+        """
+        self._buffer = np.empty(max(capacity, 1), dtype=f'U{max(length, 1)}')
+        self._size = 0
+        self._max_length = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, val):
+        """
+        Append a value, coercing it to a string if it is not a string
+
+        Returns:
+            None
+        """
+        val = str(val)
+        self._reserve(self._size + 1, len(val))
+        self._buffer[self._size] = val
+        self._size += 1
+        self._max_length = max(self._max_length, len(val))
+
+    def extend(self, vals):
+        """
+        Append many values at once, coercing them to strings if they are not strings
+
+        Returns:
+            None
+        """
+        vals = np.asarray(vals, dtype='U').ravel()
+        val_length = get_length_from_unicode_dtype(vals.dtype)
+        self._reserve(self._size + len(vals), val_length)
+        self._buffer[self._size:self._size + len(vals)] = vals
+        self._size += len(vals)
+        if len(vals):
+            self._max_length = max(self._max_length, val_length)
+
+    def to_array(self):
+        """
+        Returns the values appended so far as a new array, with the unicode length of the longest value appended
+
+        Returns:
+            (np.array): Array of dtype U<n>
+        """
+        return self._buffer[:self._size].astype(f'U{max(self._max_length, 1)}')
+
+    def _reserve(self, capacity, length):
+        """
+        Make sure the buffer can hold capacity elements of the given unicode length, growing it geometrically if not
+        """
+        buffer_length = get_length_from_unicode_dtype(self._buffer.dtype)
+        if capacity <= len(self._buffer) and length <= buffer_length:
+            return
+        if capacity > len(self._buffer):
+            capacity = max(capacity, 2 * len(self._buffer))
+        else:
+            capacity = len(self._buffer)
+        if length > buffer_length:
+            length = max(length, 2 * buffer_length)
+        else:
+            length = buffer_length
+        buffer = np.empty(capacity, dtype=f'U{length}')
+        buffer[:self._size] = self._buffer[:self._size]
+        self._buffer = buffer
+
+
+class StringColumn:
+    def __init__(self, offsets, data):
+        """
+        Compact column of variable-length strings, stored as an offsets array plus a UTF-8 byte buffer
+
+        String i is data[offsets[i]:offsets[i+1]] decoded as UTF-8 (the same layout as an Arrow string array).  Unlike
+        a fixed-width U<n> array, which uses 4 bytes per character for every element padded to the longest string,
+        this uses one byte per (ASCII) character plus one offset per element, so a single long outlier does not inflate
+        the whole column.
+
+        The arrays are wrapped without copying, so a column can be built zero-copy from existing buffers (eg those of
+        an Arrow string array).  Converting from or to a U<n> array (see from_array and to_array) always has to
+        transcode between UTF-32 and UTF-8, so it is done with vectorized passes over the data in chunks.
+
+        Args:
+            offsets (np.array): Integer array of n+1 non-decreasing offsets into data
+            data (np.array or bytes): UTF-8 encoded bytes of the strings, as a uint8 array or bytes-like object
+        """
+        offsets = np.asarray(offsets)
+        if offsets.ndim != 1 or len(offsets) < 1 or offsets.dtype.kind not in 'iu':
+            raise ValueError("offsets must be a 1-dimensional integer array of length n+1")
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(data, dtype=np.uint8)
+        self.offsets = offsets
+        self.data = np.asarray(data, dtype=np.uint8)
+
+    @classmethod
+    def from_array(cls, a, chunk_size=2**16):
+        """
+        Build a StringColumn from a unicode array (or any iterable of strings)
+
+        Args:
+            a (np.array or iterable): Strings to store
+            chunk_size (int): Number of strings encoded at a time, bounding the size of the temporary fixed-width
+                              byte arrays used for encoding
+
+        Returns:
+            (StringColumn)
+        """
+        a = np.asarray(a, dtype='U').ravel()
+        lengths = np.zeros(len(a), dtype=np.int64)
+        data = []
+        for start in range(0, len(a), chunk_size):
+            encoded = np.char.encode(a[start:start + chunk_size], 'utf-8')
+            chunk_lengths = np.char.str_len(encoded)
+            lengths[start:start + len(encoded)] = chunk_lengths
+            # Keep only the bytes of each fixed-width row that belong to the string (dropping the null padding)
+            encoded_bytes = encoded.view(np.uint8).reshape(len(encoded), encoded.itemsize)
+            data.append(encoded_bytes[np.arange(encoded.itemsize) < chunk_lengths[:, np.newaxis]])
+
+        offsets = np.zeros(len(a) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        data = np.concatenate(data) if data else np.zeros(0, dtype=np.uint8)
+        return cls(offsets, data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        """
+        Total bytes used by the offsets and data arrays
+        """
+        return self.offsets.nbytes + self.data.nbytes
+
+    def lengths(self):
+        """
+        Returns the length in bytes (not characters) of each string
+        """
+        return np.diff(self.offsets).astype(np.int64, copy=False)
+
+    def to_array(self):
+        """
+        Returns the strings as a unicode (U<n>) array
+
+        Returns:
+            (np.array): Array of dtype U<n>, where n is the length of the longest string
+        """
+        lengths = self.lengths()
+        width = int(lengths.max()) if len(lengths) else 0
+        if width == 0:
+            return np.full(len(self), '', dtype='U1')
+        padded = np.zeros((len(self), width), dtype=np.uint8)
+        rows, columns = self._byte_positions(lengths)
+        padded[rows, columns] = self.data[self.offsets[0]:self.offsets[-1]]
+        return np.char.decode(padded.view(f'S{width}').ravel(), 'utf-8')
+
+    def tolist(self):
+        """
+        Returns the strings as a list of str
+        """
+        data = self.data.tobytes()
+        return [data[start:stop].decode('utf-8') for start, stop in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def take(self, indices):
+        """
+        Returns a new StringColumn of the strings at the given indices
+
+        Args:
+            indices (np.array): Integer indices (negative indices count from the end) or a boolean mask
+
+        Returns:
+            (StringColumn)
+        """
+        indices = self._normalize_indices(indices)
+        starts = self.offsets[indices].astype(np.int64, copy=False)
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return StringColumn(offsets, self.data[self._gather_positions(starts, offsets, lengths)])
+
+    def unique(self, return_inverse=False):
+        """
+        Returns the sorted unique strings, in the same order as np.unique would sort them
+
+        Strings are grouped by their byte length, and each group is made unique with a vectorized np.unique over a
+        fixed-width byte matrix of that length only, so no buffer is ever padded to the longest string.
+
+        Args:
+            return_inverse (bool): If True, also return the indices into the unique strings that rebuild this column
+
+        Returns:
+            (StringColumn): Unique strings
+            (np.array): (if return_inverse==True) Integer indices such that unique.take(inverse) equals this column
+        """
+        lengths = self.lengths()
+        unique_strings = []
+        local_inverse = np.zeros(len(self), dtype=np.int64)
+        for length in np.unique(lengths):
+            rows = np.flatnonzero(lengths == length)
+            if length == 0:
+                unique_rows = np.zeros((1, 0), dtype=np.uint8)
+                inverse = np.zeros(len(rows), dtype=np.int64)
+            else:
+                matrix = self.data[self.offsets[rows][:, np.newaxis] + np.arange(length)]
+                unique_rows, inverse = np.unique(matrix, axis=0, return_inverse=True)
+            local_inverse[rows] = len(unique_strings) + inverse.ravel()
+            unique_strings.extend(row.tobytes() for row in unique_rows)
+
+        # UTF-8 byte order matches unicode code point order, which is how np.unique sorts U arrays
+        order = sorted(range(len(unique_strings)), key=unique_strings.__getitem__)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum([len(unique_strings[i]) for i in order], out=offsets[1:])
+        unique = StringColumn(offsets, b''.join(unique_strings[i] for i in order))
+        if return_inverse:
+            return unique, rank[local_inverse]
+        return unique
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            key = int(key) + len(self) if key < 0 else int(key)
+            return self.data[self.offsets[key]:self.offsets[key + 1]].tobytes().decode('utf-8')
+        elif isinstance(key, slice) and key.step in (None, 1):
+            # Contiguous slices share the data without copying
+            start, stop, _ = key.indices(len(self))
+            return StringColumn(self.offsets[start:max(start, stop) + 1], self.data)
+        return self.take(key)
+
+    def __setitem__(self, key, values):
+        """
+        Set the strings at key (an index, slice, integer array or boolean mask) to values
+
+        Values may be a single string or an iterable of strings aligned with key.  As strings may change length, the
+        data buffer is rebuilt with one vectorized gather
+        """
+        indices = self._normalize_indices(key)
+        if isinstance(values, str):
+            values = [values] * len(indices)
+        values = values if isinstance(values, StringColumn) else StringColumn.from_array(values)
+        if len(values) != len(indices):
+            raise ValueError(f"Cannot set {len(values)} values at {len(indices)} indices")
+
+        value_starts = values.offsets[:-1].astype(np.int64) - values.offsets[0]
+        lengths = self.lengths().copy()
+        lengths[indices] = np.diff(values.offsets)
+        # Where each string's bytes come from in the concatenation of the old data and the new values
+        source_starts = self.offsets[:-1].astype(np.int64)
+        source_starts[indices] = len(self.data) + value_starts
+        source = np.concatenate((self.data, values.data[values.offsets[0]:values.offsets[-1]]))
+
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        self.data = source[self._gather_positions(source_starts, offsets, lengths)]
+        self.offsets = offsets
+
+    def __eq__(self, other):
+        """
+        Returns a boolean array of elementwise equality with a string, a StringColumn or an iterable of strings
+        """
+        lengths = self.lengths()
+        if isinstance(other, str):
+            other = np.frombuffer(other.encode('utf-8'), dtype=np.uint8)
+            rows = np.flatnonzero(lengths == len(other))
+            matrix = self.data[self.offsets[rows][:, np.newaxis] + np.arange(len(other))]
+            equal = np.zeros(len(self), dtype=bool)
+            equal[rows] = np.all(matrix == other, axis=1)
+            return equal
+
+        if not isinstance(other, StringColumn):
+            other = StringColumn.from_array(other)
+        if len(other) != len(self):
+            raise ValueError(f"Cannot compare StringColumns of length {len(self)} and {len(other)}")
+        rows = np.flatnonzero(lengths == other.lengths())
+        row_lengths = lengths[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=offsets[1:])
+        self_bytes = self.data[self._gather_positions(self.offsets[rows], offsets, row_lengths)]
+        other_bytes = other.data[self._gather_positions(other.offsets[rows], offsets, row_lengths)]
+        # Count the mismatched bytes in each row
+        mismatches = np.bincount(np.repeat(np.arange(len(rows)), row_lengths)[self_bytes != other_bytes],
+                                 minlength=len(rows))
+        equal = np.zeros(len(self), dtype=bool)
+        equal[rows] = mismatches == 0
+        return equal
+
+    def __ne__(self, other):
+        return ~(self == other)
+
+    __hash__ = None
+
+    def _normalize_indices(self, key):
+        """
+        Returns key (an index, slice, integer array or boolean mask) as an array of non-negative integer indices
+        """
+        if isinstance(key, slice):
+            return np.arange(len(self))[key]
+        indices = np.asarray(key)
+        if indices.dtype == bool:
+            return np.flatnonzero(indices)
+        indices = indices.astype(np.int64, copy=False).ravel()
+        return np.where(indices < 0, indices + len(self), indices)
+
+    def _byte_positions(self, lengths):
+        """
+        Returns the (row, column) of every byte of data[offsets[0]:offsets[-1]] in a padded row-per-string matrix
+        """
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        columns = np.arange(len(rows)) - np.repeat(self.offsets[:-1] - self.offsets[0], lengths)
+        return rows, columns
+
+    @staticmethod
+    def _gather_positions(starts, offsets, lengths):
+        """
+        Returns the source positions of every byte when gathering strings of the given lengths from the given starts
+        into a new buffer laid out by offsets
+        """
+        return np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
@@ -1,33 +1,227 @@
+import collections
+import concurrent.futures
+import os
 import numpy as np
+import pandas as pd
+import scipy.sparse
 
 
-def safe_astype(ds, dtype, always_convert_to_object=True):
+# Marks columns that safe_astype_frame leaves unconverted
+_UNCHANGED = object()
+
+
+def safe_astype(ds, dtype, always_convert_to_object=True, nullable=False):
     """
     Return a copy of a Pandas Series converted to a new dtype, actively preserving np.nan entries in the original data.
     
     This is useful to avoid things like how ds.astype(str) will convert np.nan entries into a string 'nan'.
     The output series may be of type object so that it can have mixed types (mix of string and np.nan (float), 
     for example)
+
+    If nullable==True and dtype has a pandas nullable equivalent (str->string, int->Int64, float->Float64,
+    bool->boolean, etc), the data is instead converted directly to that dtype, where missing entries are kept as a mask
+    (pd.NA) rather than boxed into an object series.  If that conversion fails (eg, converting non-integer floats to
+    Int64), the object dtype conversion is used as a fallback.
     
     Args:
         ds (pandas.Series): Data to be converted
         dtype: Valid data type that pd.Series.astype() accepts
         always_convert_to_object (bool): If True, always return a series that is of dtype object
-                                         If False, only return dtype of object if there are np.nan entries in the original data
+                                         If False, only return dtype of object if there are np.nan entries in the
+                                         original data
+                                         Ignored if the nullable conversion is used
+        nullable (bool): If True, convert to the pandas nullable equivalent of dtype where one exists
         
     Return:
-        (pd.Series): Converted data, likely of dtype object
+        (pd.Series): Converted data, likely of dtype object (or a nullable dtype, if nullable==True)
     """
-    ds = ds.copy()
-    if always_convert_to_object or ds.isna().sum() > 0:
-        ds = ds.astype(object)
-        ds.loc[ds.notna()] = ds.loc[ds.notna()].astype(dtype)
+    if nullable:
+        nullable_dtype = _get_nullable_dtype(dtype)
+        if nullable_dtype is not None:
+            try:
+                return ds.astype(nullable_dtype)
+            except (TypeError, ValueError):
+                pass
+
+    not_na = ds.notna().to_numpy()
+    if always_convert_to_object or not not_na.all():
+        ds = pd.Series(_to_object_preserving_nan(ds, dtype, not_na), index=ds.index, name=ds.name, dtype=object)
     else:
         # Convert everything since there are no NaN
         ds = ds.astype(dtype)
     return ds
 
 
+def safe_astype_frame(df, dtypes, always_convert_to_object=True, nullable=False, n_workers=1):
+    """
+    Return a copy of a Pandas DataFrame with columns converted to new dtypes, preserving np.nan entries
+
+    See safe_astype for how each column is converted.
+
+    The result is the same as applying safe_astype to each column, but columns that share a target (and source) dtype
+    are converted together as one block, blocks are converted in parallel over a thread pool, and the output DataFrame
+    is assembled in a single concat rather than column by column.
+
+    Args:
+        df (pd.DataFrame): Data to be converted
+        dtypes (dict): Dict of {column: dtype} of the columns to convert, where dtype is anything that safe_astype
+                       accepts.  Columns not in dtypes are returned unchanged.  May also be a single dtype to apply to
+                       every column
+        always_convert_to_object (bool): See safe_astype
+        nullable (bool): See safe_astype
+        n_workers (int): Number of threads to convert blocks with.  If None, uses one per CPU
+
+    Returns:
+        (pd.DataFrame): Converted data, with the same index and column order as df
+    """
+    if not isinstance(dtypes, dict):
+        dtypes = {column: dtypes for column in df.columns}
+
+    # Group column positions (so duplicate names are handled) by target and source dtype, so that each block can be
+    # converted as a single 2D array where possible
+    groups = {}
+    for position, (column, source) in enumerate(df.dtypes.items()):
+        dtype = dtypes.get(column, _UNCHANGED)
+        groups.setdefault((dtype, source), []).append(position)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # Split groups into at most n_workers blocks each so a single large group is still spread over the workers
+    tasks = []
+    for (dtype, _), positions in groups.items():
+        n_blocks = min(n_workers, len(positions)) if dtype is not _UNCHANGED else 1
+        tasks.extend((dtype, block) for block in np.array_split(np.array(positions), n_blocks))
+
+    def convert(task):
+        dtype, positions = task
+        block = df.iloc[:, positions]
+        if dtype is _UNCHANGED:
+            return block
+        return _safe_astype_block(block, dtype, always_convert_to_object, nullable)
+
+    if not tasks:
+        return df.copy()
+    if n_workers == 1 or len(tasks) == 1:
+        blocks = [convert(task) for task in tasks]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            blocks = list(executor.map(convert, tasks))
+
+    converted = pd.concat(blocks, axis=1)
+    order = np.argsort(np.concatenate([positions for _, positions in tasks]))
+    return converted.iloc[:, order]
+
+
+def _safe_astype_block(block, dtype, always_convert_to_object, nullable):
+    """
+    Returns safe_astype applied to each column of block, converting together every column that can be
+    """
+    if nullable:
+        nullable_dtype = _get_nullable_dtype(dtype)
+        if nullable_dtype is not None:
+            try:
+                return block.astype(nullable_dtype)
+            except (TypeError, ValueError):
+                # Some columns cannot be converted, so fall back to converting (and falling back) column by column
+                return pd.concat([safe_astype(block.iloc[:, j], dtype, always_convert_to_object, nullable)
+                                  for j in range(block.shape[1])], axis=1)
+
+    not_na = block.notna().to_numpy()
+    if always_convert_to_object:
+        to_object = np.ones(block.shape[1], dtype=bool)
+    else:
+        to_object = ~not_na.all(axis=0)
+
+    parts = []
+    if not to_object.all():
+        # Convert everything in columns without NaN
+        parts.append(block.iloc[:, ~to_object].astype(dtype))
+    if to_object.any():
+        object_positions = np.flatnonzero(to_object)
+        values = _numeric_block_to_object_preserving_nan(block.iloc[:, object_positions], dtype,
+                                                         not_na[:, object_positions])
+        if values is None:
+            values = np.empty((len(block), len(object_positions)), dtype=object)
+            for j, position in enumerate(object_positions):
+                values[:, j] = _to_object_preserving_nan(block.iloc[:, position], dtype, not_na[:, position])
+        parts.append(pd.DataFrame(values, index=block.index, columns=block.columns[object_positions], dtype=object))
+
+    converted = pd.concat(parts, axis=1) if len(parts) > 1 else parts[0]
+    order = np.argsort(np.concatenate((np.flatnonzero(~to_object), np.flatnonzero(to_object))))
+    return converted.iloc[:, order]
+
+
+def _numeric_block_to_object_preserving_nan(block, dtype, not_na):
+    """
+    Returns _to_object_preserving_nan for every column of block as one 2D object array, converted in a single numpy cast
+
+    Only applies when all columns of block share one numeric numpy dtype and dtype is a numeric numpy dtype.  Otherwise
+    returns None
+    """
+    try:
+        target = np.dtype(dtype)
+    except TypeError:
+        return None
+    sources = set(block.dtypes)
+    source = sources.pop()
+    if sources or not isinstance(source, np.dtype) or source.kind not in 'biuf' or target.kind not in 'biuf':
+        return None
+
+    values = block.to_numpy()
+    filled = np.where(not_na, values, 0)
+    if target.kind in 'iu' and filled.size:
+        # numpy casts infinite or out of range values silently, so leave pandas to raise for them
+        info = np.iinfo(target)
+        if not np.isfinite(filled).all() or filled.min() < info.min or filled.max() >= info.max + 1:
+            return None
+    converted = filled.astype(target).astype(object)
+    converted[~not_na] = values[~not_na]
+    return converted
+
+
+def _to_object_preserving_nan(ds, dtype, not_na):
+    """
+    Returns an object array of ds with the entries where not_na is True converted to dtype, and the rest left as is
+
+    Entries are converted from their object values (as ds.astype(object).astype(dtype) would), which for some data
+    differs from converting from ds's own dtype (eg the string format of datetimes and float32)
+    """
+    values = ds.to_numpy(dtype=object, copy=True)
+    values[not_na] = pd.Series(values[not_na], dtype=object).astype(dtype).to_numpy(dtype=object)
+    return values
+
+
+def _get_nullable_dtype(dtype):
+    """
+    Returns the pandas nullable extension dtype equivalent to dtype, or None if there is not one
+
+    Args:
+        dtype: Valid data type that pd.Series.astype() accepts
+
+    Returns:
+        (pd.api.extensions.ExtensionDtype): Nullable dtype (eg pd.Int64Dtype() for int), or None
+    """
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return dtype
+    if dtype in (str, 'str'):
+        return pd.StringDtype()
+    try:
+        dtype = np.dtype(dtype)
+    except TypeError:
+        return None
+    if dtype.kind in 'iuf':
+        # eg int32 -> Int32, uint8 -> UInt8, float64 -> Float64.  Some (eg float16) have no nullable equivalent
+        try:
+            return pd.api.types.pandas_dtype(dtype.name.capitalize().replace('Uint', 'UInt'))
+        except TypeError:
+            return None
+    elif dtype.kind == 'b':
+        return pd.BooleanDtype()
+    elif dtype.kind == 'U':
+        return pd.StringDtype()
+    return None
+
+
 def get_zero_axes(df, return_sums=False, axis=1, isclose_kwargs=None):
     """
     Returns the name and integer index of all rows (or columns) that have an axis-wise sum of 0.
@@ -35,10 +229,13 @@ def get_zero_axes(df, return_sums=False, axis=1, isclose_kwargs=None):
     Whether the sums equal zero are determined using np.isclose.  If isclose_kwargs==None, the default np.isclose
     tolerances will be applied.
 
+    df may also be a scipy.sparse matrix, in which case rows and columns are named by their integer index, or a
+    DataFrame of pandas sparse columns.  Both are summed over their stored (nonzero) values only, without densifying.
+
     Optionally also returns the sums in a pd.Series
 
     Args:
-        df (pd.DataFrame): DataFrame to be evaluated
+        df (pd.DataFrame or scipy.sparse matrix): DataFrame to be evaluated
         return_sums (Boolean): If True, returns an extra argument with the sums as a pd.Series
         axis (int): Integer axis passed to df.sum().  Must be 0 or 1 (DataFrame is only 2 dimensional).
                     Axis follows the pandas/numpy convention for axis numbering, which denotes which axis will be
@@ -60,9 +257,77 @@ def get_zero_axes(df, return_sums=False, axis=1, isclose_kwargs=None):
         isclose_kwargs = {}
 
     if axis > 1:
-        raise NotImplementedError("Got axis={axis}.  Function not tested for axis > 1")
+        raise NotImplementedError(f"Got axis={axis}.  Function not tested for axis > 1")
+
+    row_sums = _sum_axis(df, axis)
+    return _zero_axes_from_sums(row_sums, return_sums, isclose_kwargs)
+
+
+def get_zero_axes_chunked(source, return_sums=False, axis=1, isclose_kwargs=None, chunksize=100000, n_workers=1,
+                          read_kwargs=None):
+    """
+    Returns the same as get_zero_axes, but reads the data chunk by chunk so the full DataFrame is never in memory
+
+    Row sums (axis==1) are computed for each chunk and concatenated, and column sums (axis==0) are accumulated across
+    chunks, so memory use is bounded by the chunk size plus the sums themselves.
+
+    Args:
+        source: One of:
+                    path (str or os.PathLike) to a CSV file, read with pd.read_csv(chunksize=chunksize)
+                    path to a Parquet file (ending in .parquet or .pq), read in batches of chunksize rows.  Requires
+                    the optional dependency pyarrow (pip install general_utils[parquet])
+                    iterable of pd.DataFrames, each a chunk of rows of the full data
+        return_sums (Boolean): See get_zero_axes
+        axis (int): See get_zero_axes
+        isclose_kwargs (dict): See get_zero_axes
+        chunksize (int): Number of rows per chunk when reading from a path
+        n_workers (int): Number of threads to sum chunks with.  Chunks are read sequentially, and at most 2*n_workers
+                         chunks are held in memory at once.  If None, uses one per CPU
+        read_kwargs (dict): Keyword arguments passed to pd.read_csv (default {'index_col': 0}, matching
+                            DataFrame.to_csv) or pyarrow.parquet.ParquetFile.iter_batches
+
+    Returns:
+        See get_zero_axes
+    """
+    if isclose_kwargs is None:
+        isclose_kwargs = {}
+
+    if axis > 1:
+        raise NotImplementedError(f"Got axis={axis}.  Function not tested for axis > 1")
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    chunks = _iter_chunks(source, chunksize, read_kwargs)
+    chunk_sums = _map_bounded(lambda chunk: _sum_axis(chunk, axis), chunks, n_workers)
+
+    if axis == 1:
+        sums = list(chunk_sums)
+        row_sums = pd.concat(sums) if sums else pd.Series(dtype=float)
+    else:
+        row_sums = pd.Series(dtype=float)
+        for i, sums in enumerate(chunk_sums):
+            row_sums = sums if i == 0 else row_sums.add(sums, fill_value=0)
+
+    return _zero_axes_from_sums(row_sums, return_sums, isclose_kwargs)
+
+
+def _sum_axis(df, axis):
+    """
+    Returns df.sum(axis=axis) as a pd.Series, summing only the stored values of scipy.sparse or pandas sparse data
+    """
+    if scipy.sparse.issparse(df):
+        return pd.Series(np.asarray(df.sum(axis=axis)).ravel())
+    if len(df.columns) and all(isinstance(dtype, pd.SparseDtype) and dtype.fill_value == 0 for dtype in df.dtypes):
+        index = df.columns if axis == 0 else df.index
+        return pd.Series(np.asarray(df.sparse.to_coo().sum(axis=axis)).ravel(), index=index)
+    return df.sum(axis=axis)
 
-    row_sums = df.sum(axis=axis)
+
+def _zero_axes_from_sums(row_sums, return_sums, isclose_kwargs):
+    """
+    Returns the names and integer indices of the zero entries of row_sums (see get_zero_axes)
+    """
     zero_bool = np.isclose(row_sums, 0.0, **isclose_kwargs)
     zero_names = row_sums.index[zero_bool].values
     zero_indices = np.arange(len(row_sums))[zero_bool]
@@ -71,3 +336,45 @@ def get_zero_axes(df, return_sums=False, axis=1, isclose_kwargs=None):
         return zero_names, zero_indices, row_sums
     else:
         return zero_names, zero_indices
+
+
+def _iter_chunks(source, chunksize, read_kwargs):
+    """
+    Yields DataFrame chunks from a CSV or Parquet path, or from an iterable of DataFrames (see get_zero_axes_chunked)
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        yield from source
+        return
+
+    if str(source).lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet
+
+        parquet_file = pyarrow.parquet.ParquetFile(source)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, **(read_kwargs or {})):
+            yield batch.to_pandas()
+    else:
+        if read_kwargs is None:
+            read_kwargs = {'index_col': 0}
+        with pd.read_csv(source, chunksize=chunksize, **read_kwargs) as reader:
+            yield from reader
+
+
+def _map_bounded(function, iterable, n_workers):
+    """
+    Yields function(item) for each item of iterable in order, computed over n_workers threads
+
+    At most 2*n_workers items are submitted ahead of the results consumed, so a long (or lazily read) iterable is
+    never pulled into memory all at once
+    """
+    if n_workers == 1:
+        yield from map(function, iterable)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,17 +1,18 @@
 import numpy as np
-import itertools
 import pandas as pd
+import scipy.sparse
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
+from matplotlib.collections import PatchCollection
 from matplotlib.patches import Rectangle
 
 from sklearn.metrics import confusion_matrix
 
-from general_utils.pandas import get_zero_axes
-
 NOT_SPECIFIED = 'NOT_SPECIFIED'
+# Most tick labels drawn on each axis of a confusion matrix plotted with max_classes
+MAX_TICK_LABELS = 60
 
 
 def cmap_to_discrete(cmap, vmin=0., vmax=1., bin_increment=0.1, increments=None, increment_limit=21):
@@ -61,7 +62,8 @@ def cmap_to_discrete(cmap, vmin=0., vmax=1., bin_increment=0.1, increments=None,
 
 
 def heatmap(data, xticklabels, yticklabels, xlabel="", ylabel="", textcolor="red", fontsize=None,
-            cmap='Greys', number_fmt='.2f', fontweight_max='bold', fontweight_min='normal', ax=None, savefig=False):
+            cmap='Greys', number_fmt='.2f', fontweight_max='bold', fontweight_min='normal', ax=None, savefig=False,
+            max_annotated_cells=None, rasterize_annotations=False):
     """
     Return a basic labelled heatmap of the numberic data, with data[0,0] placed in the upper left
 
@@ -77,6 +79,10 @@ def heatmap(data, xticklabels, yticklabels, xlabel="", ylabel="", textcolor="red
     :param cmap: cmap designation passed to imshow()
     :param number_fmt: Format string for the numbers printed in the heatmap
     :param savefig: If not False, save the figure generated here to savefig
+    :param max_annotated_cells: If not None, cells are only annotated with their numbers if there are at most this
+                                many of them (annotating very large heatmaps is slow and unreadable)
+    :param rasterize_annotations: If True, the annotations are rasterized when saving to vector formats (pdf, svg),
+                                  which keeps files of large heatmaps small
 
     :return: tuple of (matplotlib figure, matplotlib axes)
     """
@@ -96,17 +102,19 @@ def heatmap(data, xticklabels, yticklabels, xlabel="", ylabel="", textcolor="red
 
     fig, ax = get_fig_ax(ax=ax)
 
-    # Set fontweight dict to help with formatting
-    fontweight = np.chararray(data.shape, itemsize=20, unicode=True)
-    fontweight[:] = 'normal'
-    # Set weight for max/min cells for highlighting
-    fontweight[np.unravel_index(data.argmax(), data.shape)] = fontweight_max
-    fontweight[np.unravel_index(data.argmin(), data.shape)] = fontweight_min
-
-    for i, j in itertools.product(range(data.shape[0]), range(data.shape[1])):
-        ax.text(j, i, format(data[i, j], number_fmt),
-                horizontalalignment="center", verticalalignment='center',
-                color=textcolor, fontsize=fontsize, fontweight=fontweight[i, j])
+    if max_annotated_cells is None or data.size <= max_annotated_cells:
+        # Set fontweight of each cell to help with formatting
+        fontweight = np.full(data.shape, 'normal', dtype=object)
+        # Set weight for max/min cells for highlighting, ignoring missing (NaN) cells
+        is_missing = np.isnan(np.asarray(data, dtype=float))
+        if not is_missing.all():
+            fontweight[np.unravel_index(np.nanargmax(data), data.shape)] = fontweight_max
+            fontweight[np.unravel_index(np.nanargmin(data), data.shape)] = fontweight_min
+
+        # Missing cells are left blank rather than annotated with 'nan'
+        rows, columns = np.nonzero(~is_missing)
+        _annotate_cells(ax, rows, columns, [format(x, number_fmt) for x in data[rows, columns]], textcolor,
+                        fontsize=fontsize, fontweight=fontweight[rows, columns], rasterized=rasterize_annotations)
     ax.imshow(data, cmap=cmap)
     # Tried to force always having ticks for each box, but didn't work...
     # ax.set_xticks(np.arange(1, len(xticklabels)-1, 1))
@@ -124,8 +132,33 @@ def heatmap(data, xticklabels, yticklabels, xlabel="", ylabel="", textcolor="red
     return fig, ax
 
 
+def _annotate_cells(ax, rows, columns, labels, colors, fontsize=None, fontweight=None, rasterized=False):
+    """
+    Adds a text label centred on each (row, column) cell of an image plotted on ax
+
+    Args:
+        ax (matplotlib.pyplot.axes): Axes to annotate
+        rows (np.array): Row of each cell to annotate
+        columns (np.array): Column of each cell to annotate
+        labels (list): Text of each annotation
+        colors (str or np.array): Color of all annotations, or of each annotation
+        fontsize: fontsize parameter passed to ax.text()
+        fontweight (np.array): (OPTIONAL) fontweight of each annotation passed to ax.text()
+        rasterized (bool): If True, annotations are rasterized when saving to vector formats
+
+    Returns:
+        None
+    """
+    colors = np.broadcast_to(np.asarray(colors, dtype=object), len(labels))
+    fontweight = np.broadcast_to(np.asarray('normal' if fontweight is None else fontweight, dtype=object),
+                                 len(labels))
+    for row, column, label, color, weight in zip(rows.tolist(), columns.tolist(), labels, colors, fontweight):
+        ax.text(column, row, label, horizontalalignment='center', verticalalignment='center', color=color,
+                fontsize=fontsize, fontweight=weight, rasterized=rasterized)
+
+
 def heatmap_from_df(df, x_column, y_column, z_column, xlabel=None, ylabel=None, number_fmt='.3f', ax=None,
-                    savefig=None):
+                    savefig=None, fill_value=np.nan, aggfunc=None):
     """
     Plot a heatmap of z_column from the DataFrame df, with x and y axes pulled from x_column and y_column
 
@@ -142,8 +175,10 @@ def heatmap_from_df(df, x_column, y_column, z_column, xlabel=None, ylabel=None,
          (3.0, 2.0),
          (3.0, 3.0),
          ]
-    Function has not been tested for discrete with gaps, and likely wont work properly for continuous x,y data
-    (eg if data is not naturally binned).
+    Combinations of x and y that are missing from df are filled with fill_value.  Function likely wont work properly
+    for continuous x,y data (eg if data is not naturally binned).
+
+    The grid is built in a single pass over df (see _get_heatmap_grid), so large sweeps are fast.
 
     Args:
         df (pandas.DataFrame): DataFrame to pull data from
@@ -154,6 +189,9 @@ def heatmap_from_df(df, x_column, y_column, z_column, xlabel=None, ylabel=None,
         ylabel (str): (OPTIONAL) Name to display on the y-axis (if omitted, will display y_column)
         ax (matplotlib.pyplot.axes): (OPTIONAL) Axes object to add heatmap to
         savefig (str): (OPTIONAL) If not none, save the figure to a file with the name savefig
+        fill_value (float): (OPTIONAL) Value plotted for combinations of x and y that are not in df
+        aggfunc (str): (OPTIONAL) How to combine the z values of rows that share an x and y.  One of 'mean', 'sum' or
+                       'count'.  If None, duplicate combinations raise a ValueError
 
     Return:
         (matplotlib.pyplot.axes): Axes with heatmap
@@ -163,18 +201,51 @@ def heatmap_from_df(df, x_column, y_column, z_column, xlabel=None, ylabel=None,
     if ylabel is None:
         ylabel = y_column
 
-    x_all = df.loc[:, x_column].unique()
-    y_all = df.loc[:, y_column].unique()
-    toPlot = np.zeros((len(y_all), len(x_all)))
-    for j, y in enumerate(y_all):
-        for i, x in enumerate(x_all):
-            toPlot[j, i] = df.loc[(df.loc[:, x_column] == x) & (df.loc[:, y_column] == y)].loc[:, z_column]
+    toPlot, x_all, y_all = _get_heatmap_grid(df, x_column, y_column, z_column, fill_value=fill_value,
+                                             aggfunc=aggfunc)
     fig, ax = heatmap(toPlot, x_all, y_all, xlabel=x_column, ylabel=y_column, number_fmt=number_fmt, ax=ax,
                       savefig=savefig)
 
     return ax
 
 
+def _get_heatmap_grid(df, x_column, y_column, z_column, fill_value=np.nan, aggfunc=None):
+    """
+    Returns the grid of z_column values for heatmap_from_df, built by scattering each row into its (y, x) cell
+
+    Args:
+        (See heatmap_from_df)
+
+    Returns:
+        (tuple): Grid of shape (len(y_all), len(x_all)) (np.array), x_all (np.array), y_all (np.array), where x_all and
+                 y_all are the unique values of x_column and y_column in order of appearance
+    """
+    x_codes, x_all = pd.factorize(df.loc[:, x_column], use_na_sentinel=False)
+    y_codes, y_all = pd.factorize(df.loc[:, y_column], use_na_sentinel=False)
+    z = df.loc[:, z_column].to_numpy(dtype=float)
+    size = len(y_all) * len(x_all)
+    cells = y_codes * len(x_all) + x_codes
+    counts = np.bincount(cells, minlength=size)
+
+    if aggfunc is None:
+        if len(counts) and counts.max() > 1:
+            raise ValueError("Error: duplicate combinations of x and y found - specify aggfunc to combine them")
+        grid = np.full(size, fill_value, dtype=float)
+        grid[cells] = z
+    elif aggfunc in ('mean', 'sum', 'count'):
+        if aggfunc == 'count':
+            grid = counts.astype(float)
+        else:
+            grid = np.bincount(cells, weights=z, minlength=size)
+            if aggfunc == 'mean':
+                grid = grid / np.maximum(counts, 1)
+        grid[counts == 0] = fill_value
+    else:
+        raise ValueError(f"Invalid aggfunc '{aggfunc}'.  Must be one of 'mean', 'sum', 'count' or None")
+
+    return grid.reshape(len(y_all), len(x_all)), np.asarray(x_all), np.asarray(y_all)
+
+
 def get_fig_ax(fig=NOT_SPECIFIED, ax=NOT_SPECIFIED, fig_kwargs=None):
     """
     Convenience function to get the fig and ax objects associated with either a Matplotlib fig or axes
@@ -201,14 +272,16 @@ def get_fig_ax(fig=NOT_SPECIFIED, ax=NOT_SPECIFIED, fig_kwargs=None):
     return fig, ax
 
 
-def _compute_confusion_matrix_data(y_true, y_pred, class_name_map=None, classes_shown_on_x=None, classes_shown_on_y=None,
-                                   remove_if_better_than=False, remove_irrelevant_x=True, remove_irrelevant_y=True,
-                                   normalize=True, sort=True):
+def _compute_confusion_matrix_data(y_true, y_pred=None, class_name_map=None, classes_shown_on_x=None,
+                                   classes_shown_on_y=None, remove_if_better_than=False, remove_irrelevant_x=True,
+                                   remove_irrelevant_y=True, normalize=True, sort=True, sparse=False, engine='auto'):
     """
     Support function for computing data to build a confusion matrix
 
     Args:
-        y_true (np.array or iterable): Iterable of truth data (to be shown on the y-axis)
+        y_true (np.array or iterable): Iterable of truth data (to be shown on the y-axis), or a
+                                       ConfusionMatrixAccumulator of already counted data (in which case y_pred must be
+                                       None)
         y_pred (np.array or iterable): Iterable of prediccted data (to be shown on the x-axis)
         class_name_map (dict or map): (OPTIONAL) Map to replace given class names.  For example, use to replace machine-
                                       readable class names with human-readable class names
@@ -219,116 +292,475 @@ def _compute_confusion_matrix_data(y_true, y_pred, class_name_map=None, classes_
         savefig (str): (OPTIONAL) Filename to save the figure to
         ax (Axes): (OPTIONAL) Axes to plot to
         sort:
+        sparse (bool): If True, the confusion matrix is built, normalized, sorted and subset as a scipy.sparse matrix,
+                       so memory scales with the number of nonzero cells rather than the square of the number of
+                       classes.  The returned cm is then a scipy.sparse.csr_matrix
+        engine (str): How the confusion matrix is counted.  One of:
+                        'bincount': Factorize y_true and y_pred once into integer codes and count every (true, pred)
+                                    pair with a single np.bincount.  Labels must be sortable and not NaN
+                        'sklearn': Use sklearn.metrics.confusion_matrix
+                        'auto': (DEFAULT) Use 'bincount', falling back to 'sklearn' if the labels do not support it
 
     Returns:
 
     """
+    if engine not in ('auto', 'bincount', 'sklearn'):
+        raise ValueError(f"Invalid engine '{engine}'.  Must be one of 'auto', 'bincount' or 'sklearn'")
+
+    if isinstance(y_true, ConfusionMatrixAccumulator):
+        if y_pred is not None:
+            raise ValueError("Error: y_pred must be None when y_true is a ConfusionMatrixAccumulator")
+    elif y_pred is None:
+        raise ValueError("Error: y_pred must be specified unless y_true is a ConfusionMatrixAccumulator")
+
+    factorized = None
+    if engine != 'sklearn' and not isinstance(y_true, ConfusionMatrixAccumulator):
+        try:
+            factorized = _factorize_labels(y_true, y_pred)
+        except (TypeError, ValueError):
+            if engine == 'bincount':
+                raise
+
+    if classes_shown_on_y is None or classes_shown_on_x is None:
+        default_classes = _get_default_classes(y_true, y_pred, factorized)
     if classes_shown_on_y is None:
-        unique_true = np.unique(y_true)
-        pred_not_in_true = [x for x in np.unique(y_pred) if not (x in unique_true)]
-        classes_shown_on_y = np.hstack((unique_true, pred_not_in_true))
+        classes_shown_on_y = default_classes
     else:
         classes_shown_on_y = np.asarray(classes_shown_on_y)
     if classes_shown_on_x is None:
-        unique_true = np.unique(y_true)
-        pred_not_in_true = [x for x in np.unique(y_pred) if not (x in unique_true)]
-        classes_shown_on_x = np.hstack((unique_true, pred_not_in_true))
+        classes_shown_on_x = default_classes
     else:
         classes_shown_on_x = np.asarray(classes_shown_on_x)
 
     # Compute confusion matrix
     # Include all classes from both x and y initially
     all_classes = list(set(classes_shown_on_y) | set(classes_shown_on_x))
-    cm = confusion_matrix(y_true, y_pred, labels=all_classes)
-    cm_df = pd.DataFrame(cm, index=all_classes, columns=all_classes)
 
+    if isinstance(y_true, ConfusionMatrixAccumulator):
+        cm = y_true.counts(all_classes).to_numpy()
+        if sparse:
+            cm = scipy.sparse.csr_matrix(cm)
+    elif sparse:
+        true_codes, pred_codes = _get_confusion_matrix_codes(y_true, y_pred, pd.Index(all_classes), factorized)
+        cm = scipy.sparse.coo_matrix((np.ones(len(true_codes), dtype=np.int64), (true_codes, pred_codes)),
+                                     shape=(len(all_classes), len(all_classes))).tocsr()
+    elif factorized is not None:
+        true_codes, pred_codes = _get_confusion_matrix_codes(y_true, y_pred, pd.Index(all_classes), factorized)
+        k = len(all_classes)
+        cm = np.bincount(true_codes * k + pred_codes, minlength=k * k).reshape(k, k)
+    else:
+        cm = confusion_matrix(y_true, y_pred, labels=all_classes)
+
+    cm, classes_shown_on_x, classes_shown_on_y = _select_confusion_matrix(
+        cm, all_classes, classes_shown_on_x, classes_shown_on_y, remove_if_better_than, remove_irrelevant_x,
+        remove_irrelevant_y, normalize, sort)
+
+    return _confusion_matrix_data(cm, classes_shown_on_x, classes_shown_on_y, class_name_map)
+
+
+def _confusion_matrix_data(cm, classes_shown_on_x, classes_shown_on_y, class_name_map):
+    """
+    Returns the dict of confusion matrix data returned by _compute_confusion_matrix_data
+    """
+    # We want to show all ticks...
+    if class_name_map is not None:
+        xticklabels = [class_name_map.get(c, c) for c in classes_shown_on_x]
+        yticklabels = [class_name_map.get(c, c) for c in classes_shown_on_y]
+    else:
+        xticklabels = classes_shown_on_x
+        yticklabels = classes_shown_on_y
+
+    return {
+        'cm': cm,
+        'xticklabels': xticklabels,
+        'yticklabels': yticklabels,
+        'classes_shown_on_x': classes_shown_on_x,
+        'classes_shown_on_y': classes_shown_on_y,
+    }
+
+
+def _select_confusion_matrix(cm, all_classes, classes_shown_on_x, classes_shown_on_y, remove_if_better_than,
+                             remove_irrelevant_x, remove_irrelevant_y, normalize, sort):
+    """
+    Normalizes, filters and sorts the confusion matrix for _compute_confusion_matrix_data
+
+    Rather than taking a labelled subset of the matrix at each step, every subset is tracked as the integer positions of
+    its rows and columns in all_classes, the steps work on those positions and boolean masks over the one matrix, and
+    the shown subset is taken once at the end.
+
+    Args:
+        cm (np.array or scipy.sparse.csr_matrix): Confusion matrix of counts, with rows and columns ordered as
+                                                  all_classes
+        (See _compute_confusion_matrix_data for the others)
+
+    Returns:
+        (tuple): Matrix of the shown classes (of the same type as cm), classes_shown_on_x, classes_shown_on_y
+    """
+    all_classes_index = pd.Index(all_classes)
+
+    row_sums = None
     if normalize:
         # Normalize by the count in each row.  If a row has no data, fudge the sum to get normalized values of 0 not nan
-        row_sums = cm_df.sum(axis=1)
+        # Only the values that are used (diagonals, row sums and the final subset) are divided, not the whole matrix
+        row_sums = np.asarray(cm.sum(axis=1)).ravel()
         row_sums[row_sums < 1] = 1
-        cm_df = cm_df.div(row_sums, axis=0)
 
+    # Rows and columns (as positions in all_classes) of the subset of cm that later steps are applied to.  None means
+    # all of cm
+    view_rows = view_columns = None
 
     if remove_if_better_than:
         # Grab the relevant subset
-        cm_df = cm_df.loc[classes_shown_on_y, classes_shown_on_x]
-        diag = cm_df.values.diagonal()
+        view_rows = all_classes_index.get_indexer(classes_shown_on_y)
+        view_columns = all_classes_index.get_indexer(classes_shown_on_x)
+        diag = _get_diagonal(cm, view_rows, view_columns, row_sums)
         to_remove = ~(diag >= remove_if_better_than)
         classes_shown_on_y = classes_shown_on_y[to_remove]
         # Reorder x labels so they follow the same order as y
-        classes_shown_on_x = [c for c in classes_shown_on_y if c in classes_shown_on_x] + \
-                             [c for c in classes_shown_on_x if c not in classes_shown_on_y]
+        classes_shown_on_x = _order_like(classes_shown_on_x, classes_shown_on_y)
 
     if sort:
         # Ensure all y labels are in x (sorting is done on the diagonal, which means all y must be in x)
-        # Must be a vectorized version of this...
-        for y in classes_shown_on_y:
-            if y not in classes_shown_on_x:
-                raise ValueError("All y labels must be included as x labels as well in order to sort results")
+        if not set(classes_shown_on_y) <= set(classes_shown_on_x):
+            raise ValueError("All y labels must be included as x labels as well in order to sort results")
 
         # Grab the relevant subset
-        cm_df = cm_df.loc[classes_shown_on_y, classes_shown_on_x]
+        view_rows = all_classes_index.get_indexer(classes_shown_on_y)
+        view_columns = all_classes_index.get_indexer(classes_shown_on_x)
 
         # Get indices of rows that have no true labels and thus should not be in the sorting
         # (put them after the sorted columns)
-        _, integer_index_of_rows_without_true_labels = get_zero_axes(cm_df, return_sums=False, axis=1)
+        is_zero_row = _get_zero_rows(cm, view_rows, view_columns, row_sums)
 
-        cm = cm_df.values
         # Sort y labels in ascending order based on the diagonal (how well the classify properly)
-        sorted_y_order = np.argsort(cm.diagonal())
-        # classes_shown_on_y = classes_shown_on_y[sorted_y_order]
-        classes_shown_on_y = [classes_shown_on_y[c] for c in sorted_y_order if c not in
-                              integer_index_of_rows_without_true_labels] + \
-                             [classes_shown_on_y[c] for c in integer_index_of_rows_without_true_labels]
+        sorted_y_order = np.argsort(_get_diagonal(cm, view_rows, view_columns, row_sums))
+        sorted_y_order = np.concatenate((sorted_y_order[~is_zero_row[sorted_y_order]], np.flatnonzero(is_zero_row)))
+        classes_shown_on_y = [classes_shown_on_y[c] for c in sorted_y_order]
         # Reorder x labels so they follow the same order as y
-        classes_shown_on_x = [c for c in classes_shown_on_y if c in classes_shown_on_x] + \
-                             [c for c in classes_shown_on_x if c not in classes_shown_on_y]
+        classes_shown_on_x = _order_like(classes_shown_on_x, classes_shown_on_y)
 
     if remove_irrelevant_x:
-        to_remove = []
-        for i, x in enumerate(classes_shown_on_x):
-            if (x not in classes_shown_on_y) and (not (cm_df.loc[:, x].max() > 0)):
-                to_remove.append(i)
-        classes_shown_on_x = [classes_shown_on_x[i] for i in range(len(classes_shown_on_x)) if i not in to_remove]
+        # Remove x classes that are not on the y axis and were never predicted (in the rows of the current subset)
+        if view_rows is None:
+            is_view_row = np.ones(cm.shape[0], dtype=bool)
+        else:
+            is_view_row = np.zeros(cm.shape[0], dtype=bool)
+            is_view_row[view_rows] = True
+        if scipy.sparse.issparse(cm):
+            column_max = cm[np.flatnonzero(is_view_row)].max(axis=0).toarray().ravel() if is_view_row.any() \
+                else np.zeros(cm.shape[1])
+        else:
+            column_max = cm.max(axis=0, where=is_view_row[:, np.newaxis], initial=0)
+        is_predicted = column_max[all_classes_index.get_indexer_for(classes_shown_on_x)] > 0
+        y_set = set(classes_shown_on_y)
+        classes_shown_on_x = [x for x, predicted in zip(classes_shown_on_x, is_predicted) if predicted or x in y_set]
 
     if remove_irrelevant_y:
         # Remove anything that has no truth (row-wise sum to 0) from the y axis
-        # Find any rows without truth so we can remove them from y
-        to_remove, _ = get_zero_axes(cm_df, axis=1, return_sums=False)
+        rows = all_classes_index if view_rows is None else all_classes_index[view_rows]
+        to_remove = set(rows[_get_zero_rows(cm, view_rows, view_columns, row_sums)])
         classes_shown_on_y = [y for y in classes_shown_on_y if y not in to_remove]
 
     # Grab the relevant subset in its specified order
-    cm_df = cm_df.loc[classes_shown_on_y, classes_shown_on_x]
-    cm = cm_df.values
+    cm = _take(cm, all_classes_index.get_indexer(classes_shown_on_y), all_classes_index.get_indexer(classes_shown_on_x),
+               row_sums)
+    return cm, classes_shown_on_x, classes_shown_on_y
 
-    # We want to show all ticks...
-    if class_name_map is not None:
-        xticklabels = [class_name_map.get(c, c) for c in classes_shown_on_x]
-        yticklabels = [class_name_map.get(c, c) for c in classes_shown_on_y]
+
+def _take(cm, rows, columns, row_sums=None):
+    """
+    Returns cm[rows, :][:, columns] of a dense or sparse matrix, divided row-wise by row_sums if it is not None
+    """
+    if scipy.sparse.issparse(cm):
+        cm = cm[rows][:, columns].tocsr()
+        if row_sums is not None:
+            cm = scipy.sparse.csr_matrix((cm.data / np.repeat(row_sums[rows], np.diff(cm.indptr)), cm.indices,
+                                          cm.indptr), shape=cm.shape)
+        return cm
+    cm = cm[np.ix_(rows, columns)]
+    if row_sums is not None:
+        cm = cm / row_sums[rows][:, np.newaxis]
+    return cm
+
+
+def _get_diagonal(cm, rows, columns, row_sums=None):
+    """
+    Returns the diagonal of _take(cm, rows, columns, row_sums) without taking the subset
+    """
+    n = min(len(rows), len(columns))
+    diagonal = np.asarray(cm[rows[:n], columns[:n]]).ravel() if n else np.zeros(0, dtype=cm.dtype)
+    if row_sums is not None:
+        diagonal = diagonal / row_sums[rows[:n]]
+    return diagonal
+
+
+def _get_zero_rows(cm, rows, columns, row_sums=None):
+    """
+    Returns a boolean mask of which rows of _take(cm, rows, columns, row_sums) sum to 0 (see get_zero_axes), without
+    taking the subset.  rows and columns of None mean all of them
+    """
+    if columns is None:
+        sums = np.asarray(cm.sum(axis=1)).ravel()
     else:
-        xticklabels = classes_shown_on_x
-        yticklabels = classes_shown_on_y
+        # Sum only the subset's columns, as a product with their mask
+        is_column = np.zeros(cm.shape[1], dtype=cm.dtype)
+        is_column[columns] = 1
+        sums = np.asarray(cm @ is_column).ravel()
+    if row_sums is not None:
+        sums = sums / row_sums
+    if rows is not None:
+        sums = sums[rows]
+    return np.isclose(sums, 0.0)
+
+
+def _factorize_labels(y_true, y_pred):
+    """
+    Factorizes y_true and y_pred together into integer codes of their sorted unique labels
+
+    Args:
+        y_true (np.array or iterable): Iterable of truth data
+        y_pred (np.array or iterable): Iterable of predicted data
+
+    Returns:
+        (tuple): Sorted unique labels (np.array), codes of y_true (np.array), codes of y_pred (np.array)
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    # Concatenating would otherwise cast labels to one dtype (eg int labels to strings), silently changing them
+    kinds = {y_true.dtype.kind, y_pred.dtype.kind}
+    if len(kinds) == 1 or kinds <= set('biuf'):
+        dtype = None
+    elif 'O' in kinds:
+        dtype = object
+    else:
+        raise ValueError(f"Error: labels cannot be factorized because y_true ({y_true.dtype}) and y_pred "
+                         f"({y_pred.dtype}) have mixed label types")
+    codes, uniques = pd.factorize(np.concatenate((y_true.ravel(), y_pred.ravel()), dtype=dtype), sort=True)
+    if (codes < 0).any():
+        raise ValueError("Error: labels cannot be factorized because they contain missing values")
+    return np.asarray(uniques), codes[:y_true.size], codes[y_true.size:]
+
+
+def _get_default_classes(y_true, y_pred, factorized=None):
+    """
+    Returns the classes shown by default: the sorted unique classes of y_true, followed by those only in y_pred
+
+    Args:
+        y_true (np.array or iterable): Iterable of truth data, or a ConfusionMatrixAccumulator
+        y_pred (np.array or iterable): Iterable of predicted data
+        factorized (tuple): (OPTIONAL) Output of _factorize_labels(y_true, y_pred).  If given, classes are found from
+                            the codes in O(n) rather than with np.unique
+
+    Returns:
+        (np.array): Default classes
+    """
+    if isinstance(y_true, ConfusionMatrixAccumulator):
+        # Classes with any true samples, then those that were only predicted
+        counts = y_true.counts()
+        in_true = counts.sum(axis=1).to_numpy() > 0
+        in_pred = counts.sum(axis=0).to_numpy() > 0
+        unique_true = np.unique(np.asarray(counts.index[in_true]))
+        pred_not_in_true = list(np.unique(np.asarray(counts.index[in_pred & ~in_true])))
+        return np.hstack((unique_true, pred_not_in_true))
+
+    if factorized is None:
+        unique_true = np.unique(y_true)
+        pred_not_in_true = [x for x in np.unique(y_pred) if not (x in unique_true)]
+        return np.hstack((unique_true, pred_not_in_true))
+
+    # Take the classes from their first occurrence in y_true or y_pred, so they keep their original dtype
+    uniques, true_codes, pred_codes = factorized
+    first_true = _get_first_occurrences(true_codes, len(uniques))
+    first_pred = _get_first_occurrences(pred_codes, len(uniques))
+    in_true = first_true >= 0
+    unique_true = np.asarray(y_true).ravel()[first_true[in_true]]
+    pred_not_in_true = list(np.asarray(y_pred).ravel()[first_pred[(first_pred >= 0) & ~in_true]])
+    return np.hstack((unique_true, pred_not_in_true))
+
+
+def _get_first_occurrences(codes, n_codes):
+    """
+    Returns the index of the first occurrence of each code in codes, or -1 for codes that do not occur
+    """
+    # Fancy assignment with repeated indices has no guaranteed order, so take the minimum position of each code instead
+    first = np.full(n_codes, len(codes), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    first[first == len(codes)] = -1
+    return first
+
+
+def _get_confusion_matrix_codes(y_true, y_pred, labels, factorized=None):
+    """
+    Returns the positions in labels of y_true and y_pred, dropping samples where either is not in labels
+
+    Like sklearn.metrics.confusion_matrix(labels=labels), samples whose true or predicted class is not in labels are
+    ignored
+
+    Args:
+        y_true (np.array or iterable): Iterable of truth data
+        y_pred (np.array or iterable): Iterable of predicted data
+        labels (pd.Index): Classes that index the rows and columns of the confusion matrix
+        factorized (tuple): (OPTIONAL) Output of _factorize_labels(y_true, y_pred).  If given, only the unique labels
+                            are looked up in labels
+
+    Returns:
+        (tuple): Codes of y_true (np.array), codes of y_pred (np.array)
+    """
+    if factorized is None:
+        true_codes = labels.get_indexer(np.asarray(y_true))
+        pred_codes = labels.get_indexer(np.asarray(y_pred))
+    else:
+        uniques, true_codes, pred_codes = factorized
+        positions = labels.get_indexer(uniques)
+        true_codes = positions[true_codes]
+        pred_codes = positions[pred_codes]
+    keep = (true_codes >= 0) & (pred_codes >= 0)
+    return true_codes[keep], pred_codes[keep]
+
+
+def _order_like(classes_shown_on_x, classes_shown_on_y):
+    """
+    Returns classes_shown_on_x reordered so that those also in classes_shown_on_y come first, in the order of y
+    """
+    x_set = set(classes_shown_on_x)
+    y_set = set(classes_shown_on_y)
+    return [c for c in classes_shown_on_y if c in x_set] + [c for c in classes_shown_on_x if c not in y_set]
+
+
+def _get_worst_classes_counts(y_true, y_pred=None, max_classes=50, other_label='other', classes_shown_on_x=None,
+                              classes_shown_on_y=None, engine='auto'):
+    """
+    Returns the confusion matrix of only the classes predicted worst, with all other classes grouped into one bucket
+
+    Counts are built sparsely, each shown true class is scored by its normalized diagonal (the fraction of its samples
+    predicted correctly), and the max_classes lowest scores are selected with np.argpartition rather than a full sort.
+    Rows and columns of every other class are summed into a single other_label class, so the result is at most
+    (max_classes + 1) x (max_classes + 1) regardless of how many classes there are.
+
+    Args:
+        y_true (np.array or iterable): Iterable of truth data, or a ConfusionMatrixAccumulator of already counted data
+                                       (in which case y_pred must be None)
+        y_pred (np.array or iterable): Iterable of predicted data
+        max_classes (int): Number of worst classes kept
+        other_label: Label of the class that all other classes are grouped into.  Must not be an existing class
+        classes_shown_on_x[y] (list): (OPTIONAL) Classes considered on each axis (see _compute_confusion_matrix_data)
+        engine (str): How the confusion matrix is counted (see _compute_confusion_matrix_data)
+
+    Returns:
+        (tuple): (ConfusionMatrixAccumulator of the grouped counts, np.array of its classes (worst classes in the order
+                 shown, then other_label if any class was grouped))
+    """
+    if max_classes < 1:
+        raise ValueError(f"Error: max_classes must be at least 1.  Got {max_classes}")
+
+    data = _compute_confusion_matrix_data(
+        y_true, y_pred, classes_shown_on_x=classes_shown_on_x, classes_shown_on_y=classes_shown_on_y,
+        remove_irrelevant_x=False, remove_irrelevant_y=False, normalize=False, sort=False, sparse=True,
+        engine=engine)
+    cm = data['cm']
+    rows = pd.Index(data['classes_shown_on_y'], tupleize_cols=False)
+    columns = pd.Index(data['classes_shown_on_x'], tupleize_cols=False)
+    if other_label in rows or other_label in columns:
+        raise ValueError(f"Error: other_label '{other_label}' is already a class")
+
+    # Score each true class by its normalized diagonal.  Classes without true samples are never among the worst
+    row_sums = np.asarray(cm.sum(axis=1)).ravel()
+    diagonal_columns = columns.get_indexer(rows)
+    has_diagonal = np.flatnonzero(diagonal_columns >= 0)
+    diagonal = np.zeros(len(rows))
+    if len(has_diagonal):
+        diagonal[has_diagonal] = np.asarray(cm[has_diagonal, diagonal_columns[has_diagonal]]).ravel()
+    score = np.full(len(rows), np.inf)
+    is_true = row_sums > 0
+    score[is_true] = diagonal[is_true] / row_sums[is_true]
+
+    if max_classes < len(rows):
+        worst = np.sort(np.argpartition(score, max_classes - 1)[:max_classes])
+    else:
+        worst = np.arange(len(rows))
+    k = len(worst)
+
+    # Map every row and column to its position among the worst classes, or to the other bucket at position k
+    row_groups = np.full(len(rows), k)
+    row_groups[worst] = np.arange(k)
+    column_groups = rows[worst].get_indexer(columns)
+    column_groups[column_groups < 0] = k
+    cm = cm.tocoo()
+    counts = scipy.sparse.coo_matrix((cm.data, (row_groups[cm.row], column_groups[cm.col])),
+                                     shape=(k + 1, k + 1)).toarray()
+
+    classes = np.empty(k + 1, dtype=object)
+    classes[:k] = list(rows[worst])
+    classes[k] = other_label
+    if not (counts[k].any() or counts[:, k].any()):
+        counts = counts[:k, :k]
+        classes = classes[:k]
+    return ConfusionMatrixAccumulator.from_counts(counts, classes), classes
+
+
+def compute_confusion_matrices(y_true, y_preds, **kwargs):
+    """
+    Computes confusion matrix data for many models' predictions of the same truth data in one pass
+
+    Labels are factorized once and the counts of every model are built with a single batched np.bincount into a
+    (models, k, k) tensor, rather than rescanning y_true and rederiving the classes for each model.
+
+    Args:
+        y_true (np.array or iterable): Iterable of truth data (to be shown on the y-axis)
+        y_preds (np.array): 2D array of predicted data of shape (models, len(y_true)), one row per model
+        kwargs: Passed to _compute_confusion_matrix_data for each model (eg classes_shown_on_x, normalize, sort,
+                remove_if_better_than)
+
+    Returns:
+        Dict of:
+            classes (np.array): Sorted classes found in y_true or any of y_preds, indexing the last two axes of counts
+                                and the last axis of accuracy
+            counts (np.array): Integer array of shape (models, k, k) of the confusion matrix of each model
+            accuracy (np.array): Array of shape (models, k) of the fraction of each class's true samples that each model
+                                 predicted correctly (the diagonal of the normalized confusion matrix).  Classes without
+                                 true samples have an accuracy of 0
+            data (list): Output of _compute_confusion_matrix_data for each model
+    """
+    y_preds = np.asarray(y_preds)
+    if y_preds.ndim != 2 or y_preds.shape[1] != len(y_true):
+        raise ValueError(f"Error: y_preds must have shape (models, {len(y_true)}).  Got {y_preds.shape}")
+    n_models = len(y_preds)
+
+    classes, true_codes, pred_codes = _factorize_labels(y_true, y_preds)
+    k = len(classes)
+    pred_codes = pred_codes.reshape(n_models, -1)
+    model_offsets = np.arange(n_models)[:, np.newaxis] * k * k
+    counts = np.bincount((model_offsets + true_codes * k + pred_codes).ravel(),
+                         minlength=n_models * k * k).reshape(n_models, k, k)
+
+    row_sums = np.bincount(true_codes, minlength=k)
+    accuracy = counts[:, np.arange(k), np.arange(k)] / np.maximum(row_sums, 1)
+
+    data = [_compute_confusion_matrix_data(ConfusionMatrixAccumulator.from_counts(model_counts, classes), **kwargs)
+            for model_counts in counts]
 
     return {
-        'cm': cm,
-        'xticklabels': xticklabels,
-        'yticklabels': yticklabels,
-        'classes_shown_on_x': classes_shown_on_x,
-        'classes_shown_on_y': classes_shown_on_y,
+        'classes': classes,
+        'counts': counts,
+        'accuracy': accuracy,
+        'data': data,
     }
 
 
-def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_x=None, classes_shown_on_y=None,
+def plot_confusion_matrix(y_true, y_pred=None, class_name_map=None, classes_shown_on_x=None, classes_shown_on_y=None,
                           remove_if_better_than=False, remove_irrelevant_x=True, remove_irrelevant_y=True,
                           normalize=True, fontsize='small', figsize=None, cmap=plt.cm.Blues, savefig=None,
-                          sort=True):
+                          sort=True, sparse=False, engine='auto', max_annotated_cells=None,
+                          rasterize_annotations=False, max_classes=None, other_label='other'):
     """
     Returns a confusion matrix with integrated heatmap comparing two arrays of data
 
     Adapted from https://scikit-learn.org/stable/auto_examples/model_selection/plot_confusion_matrix.html
 
     Args:
-        y_true (np.array or iterable): Iterable of truth data (to be shown on the y-axis)
+        y_true (np.array or iterable): Iterable of truth data (to be shown on the y-axis), or a
+                                       ConfusionMatrixAccumulator of already counted data (in which case y_pred must be
+                                       None)
         y_pred (np.array or iterable): Iterable of prediccted data (to be shown on the x-axis)
         class_name_map (dict or map): (OPTIONAL) Map to replace given class names.  For example, use to replace machine-
                                       readable class names with human-readable class names
@@ -338,6 +770,18 @@ def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_
         cmap: Colormap to use to plot heatmap (background color) for confusion matrix
         savefig (str): (OPTIONAL) Filename to save the figure to
         ax (Axes): (OPTIONAL) Axes to plot to
+        sparse (bool): If True, compute the confusion matrix sparsely (see _compute_confusion_matrix_data).  Only the
+                       shown subset of the matrix is densified for plotting
+        engine (str): How the confusion matrix is counted (see _compute_confusion_matrix_data)
+        max_annotated_cells (int): (OPTIONAL) If not None, cells are only annotated with their numbers if at most this
+                                   many cells need annotations
+        rasterize_annotations (bool): If True, annotations are rasterized when saving to vector formats (pdf, svg)
+        max_classes (int): (OPTIONAL) If not None, only show the max_classes classes with the lowest normalized
+                           diagonal, grouping all others into other_label (see _get_worst_classes_counts).  The
+                           matrix is then drawn as a rasterized image, and if it is too large to label every class only
+                           every few ticks are labelled (without annotations, grid or diagonal highlighting), so
+                           plots of many classes take roughly constant time
+        other_label: Label of the class that classes not shown are grouped into when max_classes is used
 
     Returns:
         matplotlib.axes
@@ -349,6 +793,13 @@ def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_
         # Threshold for printing on confusion matrix
         thresh_text = 1
 
+    if max_classes is not None:
+        y_true, classes = _get_worst_classes_counts(y_true, y_pred, max_classes=max_classes, other_label=other_label,
+                                                    classes_shown_on_x=classes_shown_on_x,
+                                                    classes_shown_on_y=classes_shown_on_y, engine=engine)
+        y_pred = None
+        classes_shown_on_x = classes_shown_on_y = classes
+
     data = _compute_confusion_matrix_data(
         y_true=y_true,
         y_pred=y_pred,
@@ -359,9 +810,13 @@ def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_
         remove_irrelevant_x=remove_irrelevant_x,
         remove_irrelevant_y=remove_irrelevant_y,
         normalize=normalize,
-        sort=sort)
+        sort=sort,
+        sparse=sparse,
+        engine=engine)
 
     cm = data['cm']
+    if sparse:
+        cm = cm.toarray()
     xticklabels = data['xticklabels']
     yticklabels = data['yticklabels']
     classes_shown_on_x = data['classes_shown_on_x']
@@ -370,22 +825,30 @@ def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_
     if figsize is None:
         figsize = (min((len(classes_shown_on_x) + 6) / 2, 30), min((len(classes_shown_on_y) + 2) / 2, 22))
     fig, ax = plt.subplots(figsize=figsize)
-    im = ax.imshow(cm, interpolation='nearest', cmap=cmap)
+    im = ax.imshow(cm, interpolation='nearest', cmap=cmap, rasterized=max_classes is not None)
     ax.figure.colorbar(im, ax=ax)
 
+    # Label every tick unless there are too many to read, in which case (only when max_classes is used) label evenly
+    # spaced ticks and skip the per-cell decorations
+    tick_step = 1
+    if max_classes is not None:
+        tick_step = max(int(np.ceil(max(cm.shape) / MAX_TICK_LABELS)), 1)
+    label_every_cell = tick_step == 1
+
     # Cache the xlim/ylim as they may get changed by the below call
     xlim_ = ax.get_xlim()
     ylim_ = ax.get_ylim()
-    ax.set_xticks(np.arange(cm.shape[1]), )
-    ax.set_yticks(np.arange(cm.shape[0]), )
-    ax.set_xticklabels(xticklabels)
-    ax.set_yticklabels(yticklabels)
+    ax.set_xticks(np.arange(0, cm.shape[1], tick_step), )
+    ax.set_yticks(np.arange(0, cm.shape[0], tick_step), )
+    ax.set_xticklabels(list(xticklabels)[::tick_step])
+    ax.set_yticklabels(list(yticklabels)[::tick_step])
     ax.set_xlabel('True label')
     ax.set_ylabel('Predicted label')
-    ax.set_xticks(np.arange(cm.shape[1] - 1) + 0.5, minor=True)
-    ax.set_yticks(np.arange(cm.shape[0] - 1) + 0.5, minor=True)
-    ax.grid(which='minor', color='lightgrey', linestyle=':', linewidth=1)
-    ax.set_axisbelow(True)  # Move the gridlines behind the data
+    if label_every_cell:
+        ax.set_xticks(np.arange(cm.shape[1] - 1) + 0.5, minor=True)
+        ax.set_yticks(np.arange(cm.shape[0] - 1) + 0.5, minor=True)
+        ax.grid(which='minor', color='lightgrey', linestyle=':', linewidth=1)
+        ax.set_axisbelow(True)  # Move the gridlines behind the data
     ax.set_xlim(xlim_)
     ax.set_ylim(ylim_)
 
@@ -393,29 +856,25 @@ def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_
     plt.setp(ax.get_xticklabels(), rotation=45, ha="right",
              rotation_mode="anchor")
 
-    # Loop over data dimensions and create text annotations.
-    fmt = '.2f' if normalize else 'd'
-    thresh_color = cm.max() / 2.
-
-    for i in range(cm.shape[0]):
-        for j in range(cm.shape[1]):
-            if cm[i, j] >= thresh_text:
-                ax.text(j, i, format(cm[i, j], fmt),
-                        ha="center", va="center",
-                        color="white" if cm[i, j] > thresh_color else "black",
-                        fontsize=fontsize)
+    if label_every_cell:
+        # Create text annotations for the cells above the threshold, with positions and colors found in one pass
+        fmt = '.2f' if normalize else 'd'
+        thresh_color = cm.max() / 2.
 
+        rows, columns = np.nonzero(cm >= thresh_text)
+        if max_annotated_cells is None or len(rows) <= max_annotated_cells:
+            values = cm[rows, columns]
+            _annotate_cells(ax, rows, columns, [format(x, fmt) for x in values],
+                            np.where(values > thresh_color, 'white', 'black'), fontsize=fontsize,
+                            rasterized=rasterize_annotations)
 
-    # Add highlighting around the primary diagonal
-    for i, ylabel in enumerate(classes_shown_on_y):
+        # Add highlighting around the primary diagonal (the first x position of each y label), as one collection
+        x_positions = {}
         for j, xlabel in enumerate(classes_shown_on_x):
-            if xlabel == ylabel:
-                # print(xlabel, ylabel)
-                y = i - 0.5
-                x = j - 0.5
-                # print(f"Adding patch at {x}, {y}")
-                ax.add_patch(Rectangle((x, y), 1, 1, fill=False, edgecolor='g', lw=3))
-                break
+            x_positions.setdefault(xlabel, j)
+        boxes = [Rectangle((x_positions[ylabel] - 0.5, i - 0.5), 1, 1) for i, ylabel in enumerate(classes_shown_on_y)
+                 if ylabel in x_positions]
+        ax.add_collection(PatchCollection(boxes, facecolor='none', edgecolor='g', linewidth=3))
 
     fig.tight_layout()
 
@@ -423,3 +882,133 @@ def plot_confusion_matrix(y_true, y_pred, class_name_map=None, classes_shown_on_
         fig.savefig(savefig + '.png')
 
     return ax
+
+
+class ConfusionMatrixAccumulator:
+    def __init__(self):
+        """
+        Accumulates a confusion matrix of counts from batches of (y_true, y_pred), for example scored in mini-batches
+
+        Classes are added as they appear, and only the integer count matrix (never the raw labels) is stored.
+        Accumulators from parallel workers can be combined with merge, and an accumulator can be passed as y_true to
+        plot_confusion_matrix or _compute_confusion_matrix_data in place of the raw data.
+        """
+        # Classes in the order they were first seen, and their position in the count matrix
+        self._classes = []
+        self._class_positions = {}
+        # Counts of (true, pred) are in _counts[:k, :k] (k=len(_classes)), with spare capacity to add classes cheaply
+        self._counts = np.zeros((0, 0), dtype=np.int64)
+
+    @classmethod
+    def from_counts(cls, counts, classes):
+        """
+        Returns a ConfusionMatrixAccumulator holding an existing confusion matrix of counts
+
+        Args:
+            counts (np.array): Integer array of shape (k, k) of counts, with true classes on the rows and predicted
+                               classes on the columns
+            classes (iterable): The k classes that index the rows and columns of counts
+
+        Returns:
+            (ConfusionMatrixAccumulator)
+        """
+        accumulator = cls()
+        positions = accumulator._add_classes(classes)
+        if len(accumulator._classes) != len(positions):
+            raise ValueError("Error: classes must be unique")
+        accumulator._counts[:len(positions), :len(positions)] = counts
+        return accumulator
+
+    @property
+    def classes(self):
+        """
+        List of the classes seen so far, in the order they were first seen
+        """
+        return list(self._classes)
+
+    def update(self, y_true, y_pred):
+        """
+        Add a batch of true and predicted labels to the counts
+
+        Args:
+            y_true (np.array or iterable): Truth data of the batch
+            y_pred (np.array or iterable): Predicted data of the batch, aligned with y_true
+
+        Returns:
+            None
+        """
+        y_true = np.asarray(y_true).ravel()
+        y_pred = np.asarray(y_pred).ravel()
+        if len(y_true) != len(y_pred):
+            raise ValueError(f"Error: y_true and y_pred must be the same length.  Got {len(y_true)} and {len(y_pred)}")
+
+        # Factorize y_true and y_pred separately, as concatenating them could cast labels to one dtype (eg int labels
+        # to strings) and split the counts of a class across batches
+        true_codes, true_uniques = pd.factorize(y_true)
+        pred_codes, pred_uniques = pd.factorize(y_pred)
+        if (true_codes < 0).any() or (pred_codes < 0).any():
+            raise ValueError("Error: labels cannot contain missing values")
+        true_positions = self._add_classes(true_uniques)[true_codes]
+        pred_positions = self._add_classes(pred_uniques)[pred_codes]
+
+        k = len(self._classes)
+        if len(y_true) >= k * k:
+            self._counts[:k, :k] += np.bincount(true_positions * k + pred_positions, minlength=k * k).reshape(k, k)
+        else:
+            # Only count the pairs that occur, rather than allocating a whole k*k matrix for a small batch
+            pairs, pair_counts = np.unique(true_positions * k + pred_positions, return_counts=True)
+            self._counts[pairs // k, pairs % k] += pair_counts
+
+    def merge(self, other):
+        """
+        Add the counts of another ConfusionMatrixAccumulator (for example from a parallel worker) to this one
+
+        Returns:
+            None
+        """
+        positions = self._add_classes(other._classes)
+        k_other = len(other._classes)
+        self._counts[np.ix_(positions, positions)] += other._counts[:k_other, :k_other]
+
+    def counts(self, classes=None):
+        """
+        Returns the confusion matrix of counts
+
+        Args:
+            classes (list): (OPTIONAL) Classes (and their order) to return counts for.  Classes that were never seen
+                            have counts of 0.  If None, all classes seen are returned in the order they were first seen
+
+        Returns:
+            (pd.DataFrame): Counts with one row per true class and one column per predicted class
+        """
+        k = len(self._classes)
+        if classes is None:
+            classes = self._classes
+            counts = self._counts[:k, :k].copy()
+        else:
+            positions = np.array([self._class_positions.get(c, -1) for c in classes], dtype=np.int64)
+            is_seen = positions >= 0
+            counts = np.zeros((len(classes), len(classes)), dtype=np.int64)
+            counts[np.ix_(is_seen, is_seen)] = self._counts[np.ix_(positions[is_seen], positions[is_seen])]
+        index = pd.Index(classes, tupleize_cols=False)
+        return pd.DataFrame(counts, index=index, columns=index)
+
+    def _add_classes(self, classes):
+        """
+        Adds any new classes, growing the count matrix if needed, and returns the position of each class
+        """
+        positions = np.empty(len(classes), dtype=np.int64)
+        for i, c in enumerate(classes):
+            position = self._class_positions.get(c)
+            if position is None:
+                position = self._class_positions[c] = len(self._classes)
+                self._classes.append(c)
+            positions[i] = position
+
+        k = len(self._classes)
+        if k > len(self._counts):
+            # Grow capacity geometrically so adding classes one batch at a time stays amortized O(k^2)
+            counts = np.zeros((max(k, 2 * len(self._counts)),) * 2, dtype=np.int64)
+            counts[:len(self._counts), :len(self._counts)] = self._counts
+            self._counts = counts
+        return positions
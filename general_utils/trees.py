@@ -1,7 +1,13 @@
-from general_utils.dictionary import dictionaries_intersect
+import collections
+import numpy as np
+import pandas as pd
 
 
-def count_leaves_of_tree(tree, this_level='<ROOT>', count_type='all'):
+# Sentinel for a node whose children must be looked up in the tree
+_LOOKUP = object()
+
+
+def count_leaves_of_tree(tree, this_level='<ROOT>', count_type='all', dag=False):
     """
     Given a tree defined as a dictionary of lists or dicts, returns the number of leaves under each node
 
@@ -13,16 +19,17 @@ def count_leaves_of_tree(tree, this_level='<ROOT>', count_type='all'):
                      '2': ['21', '22', '23']
                      '23': ['231', '232']
                      }
-                (NOT IMPLEMENTED) dict of dicts, eg:
+                dict of dicts, where a value of None denotes a leaf, eg:
                 {'<ROOT>': {'1': {'11': None,
                                   '12': None},
                             '2': {'21': None, 
                                   '22': None, 
-                                  '23'" {'231': None,
+                                  '23': {'231': None,
                                          '232': None,}
                                   },
+                            },
                 }
-
+                or a CompiledTree
         this_level (str): Key of tree level to start counting from
         count_type (str): Specifies which type of count to be returned:
                             all: Returns a count of all descendants below a node (children, grandchildren, ...)
@@ -40,79 +47,1035 @@ def count_leaves_of_tree(tree, this_level='<ROOT>', count_type='all'):
                                          '2': 4, 
                                          '23': 2, 
                                          }
+        dag (bool): If True, tree may be a directed acyclic graph where a node has more than one parent.  Counts are
+                    then of distinct descendants, so a node reachable by several paths is counted once.  Shared
+                    subgraphs are evaluated only once.  If False, a node with more than one parent raises a ValueError
 
     Returns:
         (dict): Dict of {key: children_count} for all nodes from this level down (with counts returned according to
                 count_type)
     """
-    try:
-        if isinstance(tree[this_level], list):
-            children = tree[this_level]
-        elif isinstance(tree[this_level], set):
-            children = list(tree[this_level])
-        elif isinstance(tree[this_level], dict):
-            raise NotImplementedError("Not implemented.  Need code to know when at the bottom of a dict tree")
-            # children = list(tree[this_level].keys())
-        elif isinstance(tree[this_level], str):
-            raise TypeError(
-                "Lazy way to funnel strings into other type errors.  " 
-                "Strings might not raise an error if node labels are integers")
-        else:
-            raise ValueError(f"Unknown data type in tree[{this_level}]")
+    if count_type not in ('all', 'first', 'last'):
+        raise ValueError(f'Invalid count_type {count_type}')
 
-        leaf_counts = {this_level: 0}
-        for child in children:
-            second_generation_counts = count_leaves_of_tree(tree, this_level=child, count_type=count_type)
+    if isinstance(tree, CompiledTree):
+        if this_level not in tree:
+            return {this_level: 0}
+        return tree.to_dict(tree.count_leaves(count_type), ids=tree.subtree_ids(this_level))
 
-            # Error check to make sure the dictionaries don't intersect
-            if dictionaries_intersect(leaf_counts, second_generation_counts):
-                raise ValueError("Error: redundancy found in tree - two parents have the same child")
-            leaf_counts.update(second_generation_counts)
+    if dag:
+        nodes, order, children_of, starts = _walk_dag(tree, this_level=this_level)
+        return _count_dag_descendants(nodes, order, children_of, starts, count_type=count_type)
 
+    nodes, children_of = _walk_tree(tree, this_level=this_level)
+
+    # Nodes are in pre-order (parents before children), so walking them backwards visits every child before its parent
+    leaf_counts = dict.fromkeys(nodes, 0)
+    for node in reversed(nodes):
+        for child in children_of.get(node, ()):
             if count_type == 'all':
                 # Current level has this node plus any children under it
-                leaf_counts[this_level] += leaf_counts[child] + 1
+                leaf_counts[node] += leaf_counts[child] + 1
             elif count_type == 'first':
-                leaf_counts[this_level] += 1
-            elif count_type == 'last':
-                # If child has children, take that count.  Otherwise, add 1 (as child is final-generation) 
-                leaf_counts[this_level] += max(1, leaf_counts[child])
+                leaf_counts[node] += 1
             else:
-                raise ValueError(f'Invalid count_type {count_type}')
+                # If child has children, take that count.  Otherwise, add 1 (as child is final-generation)
+                leaf_counts[node] += max(1, leaf_counts[child])
 
-        return leaf_counts
+    return leaf_counts
 
-    except (TypeError, KeyError):
-        # This node has no children as it is not a reference to other nodes
-        return {this_level: 0}
 
+def count_future_generations(tree, this_level='<ROOT>', dag=False):
+    """
+    Given a tree defined as a dictionary of lists or dicts, returns the number of generations below each node
 
-def count_future_generations(tree, this_level='<ROOT>'):
-    try:
-        if isinstance(tree[this_level], list):
-            children = tree[this_level]
-        elif isinstance(tree[this_level], set):
-            children = list(tree[this_level])
-        elif isinstance(tree[this_level], dict):
-            raise NotImplementedError("Code exists for dictionary defined by a tree of dicts, but it was never tested")
-            # children = list(tree[this_level].keys())
-        elif isinstance(tree[this_level], str):
-            raise TypeError(
-                "Lazy way to funnel strings into other type errors.  " 
-                "Strings might not raise an error if node labels are integers")
+    Args:
+        tree (dict): Tree defined as a dict of lists, dict of dicts or a CompiledTree (see count_leaves_of_tree)
+        this_level (str): Key of tree level to start counting from
+        dag (bool): If True, tree may be a directed acyclic graph and generations are the length of the longest path
+                    below each node (see count_leaves_of_tree)
+
+    Returns:
+        (dict): Dict of {key: generations} for all nodes from this level down, where a node without children has 0
+                generations below it
+    """
+    if isinstance(tree, CompiledTree):
+        if this_level not in tree:
+            return {this_level: 0}
+        return tree.to_dict(tree.count_future_generations(), ids=tree.subtree_ids(this_level))
+
+    if dag:
+        nodes, order, children_of, _ = _walk_dag(tree, this_level=this_level)
+        return _count_dag_generations(nodes, order, children_of)
+
+    nodes, children_of = _walk_tree(tree, this_level=this_level)
+
+    depths = dict.fromkeys(nodes, 0)
+    for node in reversed(nodes):
+        for child in children_of.get(node, ()):
+            depths[node] = max(depths[node], depths[child] + 1)
+
+    return depths
+
+
+def tree_statistics(tree, this_level='<ROOT>', dag=False):
+    """
+    Returns all per-node statistics of a tree computed from a single traversal
+
+    This is equivalent to calling count_leaves_of_tree for each count_type and count_future_generations, but walks
+    (and validates) the tree only once.
+
+    Args:
+        tree (dict): Tree defined as a dict of lists, dict of dicts or a CompiledTree (see count_leaves_of_tree)
+        this_level (str): Key of tree level to start counting from
+        dag (bool): If True, tree may be a directed acyclic graph (see count_leaves_of_tree)
+
+    Returns:
+        (pd.DataFrame): DataFrame indexed by node (in the same order as count_leaves_of_tree) with columns:
+                            all: Count of all descendants below the node
+                            first: Count of first-generation descendants (children) of the node
+                            last: Count of last-generation descendants (those without children) below the node
+                            generations: Number of generations below the node
+    """
+    if isinstance(tree, CompiledTree):
+        if this_level not in tree:
+            return pd.DataFrame({'all': [0], 'first': [0], 'last': [0], 'generations': [0]}, index=[this_level])
+        return tree.statistics().iloc[tree.subtree_ids(this_level)]
+
+    if dag:
+        nodes, order, children_of, starts = _walk_dag(tree, this_level=this_level)
+        all_counts = _count_dag_descendants(nodes, order, children_of, starts, count_type='all')
+        first_counts = _count_dag_descendants(nodes, order, children_of, starts, count_type='first')
+        last_counts = _count_dag_descendants(nodes, order, children_of, starts, count_type='last')
+        generations = _count_dag_generations(nodes, order, children_of)
+    else:
+        nodes, children_of = _walk_tree(tree, this_level=this_level)
+        all_counts, first_counts, last_counts, generations = _accumulate_statistics(nodes, children_of)
+
+    return pd.DataFrame(
+        {
+            'all': list(all_counts.values()),
+            'first': list(first_counts.values()),
+            'last': list(last_counts.values()),
+            'generations': list(generations.values()),
+        },
+        index=nodes,
+    )
+
+
+def iter_tree_statistics_from_events(events):
+    """
+    Yields the per-node statistics of a nested (dict of dicts) tree while streaming through its parse events
+
+    This computes the same statistics as tree_statistics without the tree ever being held in memory, so it can be used
+    to walk documents that are too large to load, eg by passing the events from an incremental JSON parser such as
+    ijson.parse(file) or ijson.basic_parse(file).  Only the ancestors of the current node are held at any time (plus
+    the set of labels seen so far, used to detect redundancy).
+
+    The document is a JSON object mapping node labels to their children, where the value of each node is:
+        an object: children of the node, in the same form
+        an array: labels of children that are leaves
+        null (or any other scalar): the node is a leaf
+    For example:
+        {"<ROOT>": {"1": {"11": null, "12": null},
+                    "2": {"21": null, "22": null, "23": ["231", "232"]}}}
+
+    Args:
+        events (iterable): Parse events as (event, value) pairs (like ijson.basic_parse) or (prefix, event, value)
+                           triples (like ijson.parse), using the event names start_map, map_key, end_map,
+                           start_array, end_array and null/boolean/integer/double/number/string for scalars
+
+    Yields:
+        (tuple): (node, statistics) for every node in the document in post-order (every node is yielded after all of
+                 its descendants), where statistics is a dict using the same keys as the columns of tree_statistics
+    """
+    # Each frame is [node, all, first, last, generations] for a node whose children are still being streamed
+    frames = []
+    visited = set()
+    key = None
+    in_array = False
+    in_document = False
+
+    def add_label(label):
+        if label in visited:
+            raise ValueError("Error: redundancy found in tree - two parents have the same child")
+        visited.add(label)
+
+    def finish(node, n_all=0, n_first=0, n_last=0, n_generations=0):
+        if frames:
+            parent = frames[-1]
+            parent[1] += n_all + 1
+            parent[2] += 1
+            parent[3] += max(1, n_last)
+            parent[4] = max(parent[4], n_generations + 1)
+        return node, {'all': n_all, 'first': n_first, 'last': n_last, 'generations': n_generations}
+
+    for event in events:
+        if len(event) == 3:
+            _, event, value = event
         else:
-            raise ValueError(f"Unknown data type in tree[{this_level}]")
+            event, value = event
+
+        if event == 'map_key':
+            add_label(value)
+            key = value
+        elif event in ('start_map', 'start_array'):
+            if in_array:
+                raise ValueError("Arrays in the tree may only hold leaf labels")
+            if key is None:
+                if in_document:
+                    raise ValueError(f"Unexpected {event} - expected a node label")
+                # The outermost object holds the root node(s)
+                in_document = True
+                continue
+            frames.append([key, 0, 0, 0, 0])
+            key = None
+            in_array = event == 'start_array'
+        elif event in ('end_map', 'end_array'):
+            in_array = False
+            if not frames:
+                # End of the outermost object
+                in_document = False
+                continue
+            yield finish(*frames.pop())
+        elif in_array:
+            add_label(value)
+            yield finish(value)
+        elif key is not None:
+            yield finish(key)
+            key = None
+        else:
+            raise ValueError(f"Unexpected {event} - expected a node label")
+
+
+def tree_statistics_from_events(events):
+    """
+    Returns all per-node statistics of a nested (dict of dicts) tree computed while streaming through its parse events
+
+    See iter_tree_statistics_from_events for the supported events
 
-        max_depth = 0
-        depths = {this_level: 0}
+    Args:
+        events (iterable): Parse events, eg from ijson.parse(file)
+
+    Returns:
+        (pd.DataFrame): DataFrame indexed by node (in post-order) with the same columns as tree_statistics
+    """
+    nodes = []
+    columns = {'all': [], 'first': [], 'last': [], 'generations': []}
+    for node, statistics in iter_tree_statistics_from_events(events):
+        nodes.append(node)
+        for name, values in columns.items():
+            values.append(statistics[name])
+    return pd.DataFrame(columns, index=nodes)
+
+
+def _accumulate_statistics(nodes, children_of):
+    """
+    Returns dicts of the all/first/last leaf counts and future generations of each node from the output of _walk_tree
+    """
+    all_counts = dict.fromkeys(nodes, 0)
+    first_counts = dict.fromkeys(nodes, 0)
+    last_counts = dict.fromkeys(nodes, 0)
+    generations = dict.fromkeys(nodes, 0)
+    for node in reversed(nodes):
+        children = children_of.get(node)
+        if not children:
+            continue
+        n_all = n_last = n_generations = 0
         for child in children:
-            child_depths = count_future_generations(tree, this_level=child)
-            if dictionaries_intersect(depths, child_depths):
+            n_all += all_counts[child] + 1
+            n_last += max(1, last_counts[child])
+            n_generations = max(n_generations, generations[child] + 1)
+        all_counts[node] = n_all
+        first_counts[node] = len(children)
+        last_counts[node] = n_last
+        generations[node] = n_generations
+    return all_counts, first_counts, last_counts, generations
+
+
+def _get_children(tree, node, subtree=_LOOKUP):
+    """
+    Returns the children of node, or an empty tuple if node has no children
+
+    Args:
+        tree (dict): Tree defined as a dict of lists, a dict of dicts or a mix of both (see count_leaves_of_tree)
+        node: Node to get the children of
+        subtree: The value describing the children of node if it is already known (the value of node in its parent's
+                 dict when walking a dict of dicts).  If _LOOKUP, the children are looked up as tree[node].  Nodes that
+                 are not keys of tree, or whose value is a string or None, are treated as leaves
+
+    Returns:
+        Tuple of:
+            (list): Children of node
+            (list): Subtrees of each child (to pass back to _get_children) if they are known, or None if the children
+                    should be looked up in tree
+    """
+    if subtree is _LOOKUP:
+        try:
+            subtree = tree[node]
+        except (TypeError, KeyError):
+            # This node has no children as it is not a reference to other nodes
+            return (), None
+    elif subtree is None:
+        # Leaf of a dict of dicts
+        return (), None
+
+    if isinstance(subtree, list):
+        return subtree, None
+    elif isinstance(subtree, set):
+        return list(subtree), None
+    elif isinstance(subtree, dict):
+        return list(subtree.keys()), list(subtree.values())
+    elif isinstance(subtree, str):
+        # Strings might not raise an error on lookup if node labels are integers, so treat them as leaves here
+        return (), None
+    else:
+        raise ValueError(f"Unknown data type in tree[{node}]")
+
+
+def _walk_tree(tree, this_level='<ROOT>'):
+    """
+    Walks a tree from this_level down using an explicit stack, returning its nodes in pre-order
+
+    The walk visits each node exactly once, so it is O(n) and is not limited by the recursion limit.  A single visited
+    set is shared across the whole walk to detect a child that is reachable from more than one parent (or a cycle).
+
+    Args:
+        tree (dict): Tree defined as a dict of lists or dict of dicts (see count_leaves_of_tree)
+        this_level (str): Key of tree level to start walking from
+
+    Returns:
+        Tuple of:
+            (list): Nodes from this_level down in pre-order (every parent appears before its children)
+            (dict): Dict of {node: children} for every node that has children
+    """
+    nodes = []
+    children_of = {}
+    visited = {this_level}
+    stack = [this_level]
+    # Subtree of each node on the stack (see _get_children)
+    subtrees = [_LOOKUP]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        children, child_subtrees = _get_children(tree, node, subtrees.pop())
+        if children:
+            for child in children:
+                if child in visited:
+                    raise ValueError("Error: redundancy found in tree - two parents have the same child")
+                visited.add(child)
+            children_of[node] = children
+            # Push in reverse so children are popped (and thus listed) in their original order
+            stack.extend(reversed(children))
+            if child_subtrees is None:
+                subtrees.extend([_LOOKUP] * len(children))
+            else:
+                subtrees.extend(reversed(child_subtrees))
+    return nodes, children_of
+
+
+def _walk_dag(tree, this_level='<ROOT>'):
+    """
+    Walks a directed acyclic graph from this_level down using an explicit stack, visiting each node once
+
+    Unlike _walk_tree, a node may be reached from more than one parent.  It is only walked the first time it is
+    reached, so shared subgraphs are not re-walked.  A cycle raises a ValueError.
+
+    Args:
+        tree (dict): Graph defined as a dict of lists or dict of dicts (see count_leaves_of_tree)
+        this_level (str): Key of the level to start walking from
+
+    Returns:
+        Tuple of:
+            (list): Nodes from this_level down in pre-order of their first visit
+            (list): The same nodes in post-order (every node appears after all of its descendants)
+            (dict): Dict of {node: children} for every node that has children, with repeated children removed
+            (dict): Dict of {node: start}, where start is the post-order position of the first node finished after
+                    the walk entered node.  The nodes order[start[node]:position of node] are therefore exactly the
+                    descendants of node that were first reached through node
+    """
+    def unique_children(node, subtree):
+        """
+        Returns the unique children of node and an iterator of (child, subtree) pairs to walk them
+        """
+        children, child_subtrees = _get_children(tree, node, subtree)
+        if child_subtrees is None:
+            child_subtrees = [_LOOKUP] * len(children)
+        # Keep the subtree from the first time a repeated child is listed
+        unique = {}
+        for child, child_subtree in zip(children, child_subtrees):
+            unique.setdefault(child, child_subtree)
+        return list(unique), iter(unique.items())
+
+    nodes = [this_level]
+    order = []
+    children_of = {}
+    starts = {this_level: 0}
+    in_progress = {this_level}
+
+    children, children_iter = unique_children(this_level, _LOOKUP)
+    if children:
+        children_of[this_level] = children
+    stack = [(this_level, children_iter)]
+    while stack:
+        node, children_iter = stack[-1]
+        for child, child_subtree in children_iter:
+            if child in in_progress:
+                raise ValueError(f"Error: cycle found in tree - {child} is its own descendant")
+            if child not in starts:
+                in_progress.add(child)
+                nodes.append(child)
+                starts[child] = len(order)
+                children, grandchildren_iter = unique_children(child, child_subtree)
+                if children:
+                    children_of[child] = children
+                stack.append((child, grandchildren_iter))
+                break
+        else:
+            # All children of node are finished
+            stack.pop()
+            in_progress.remove(node)
+            order.append(node)
+    return nodes, order, children_of, starts
+
+
+def _count_dag_descendants(nodes, order, children_of, starts, count_type='all'):
+    """
+    Returns a dict of the count of distinct descendants of each node, using the output of _walk_dag
+
+    Counted nodes (all nodes for count_type='all', only leaves for 'last') are numbered in post-order.  The descendants
+    of a node are then held as the contiguous range of counted nodes first reached through that node, plus a bitset (a
+    Python int) of the older descendants reached through shared subgraphs that were walked earlier.  Each node is
+    evaluated once, tree-like parts of the graph never build a bitset, and a bitset is dropped as soon as all parents of
+    its node have used it.
+
+    Args:
+        count_type (str): Specifies which type of count to be returned (see count_leaves_of_tree)
+    """
+    if count_type == 'first':
+        return {node: len(children_of.get(node, ())) for node in nodes}
+
+    position = {}
+    # counted_before[i] is the number of counted nodes in order[:i]
+    counted_before = [0]
+    for i, node in enumerate(order):
+        position[node] = i
+        is_counted = count_type == 'all' or node not in children_of
+        counted_before.append(counted_before[-1] + is_counted)
+
+    counts = dict.fromkeys(nodes, 0)
+    unused_parents = collections.Counter(child for children in children_of.values() for child in children)
+    older_descendants = {}
+    for i, node in enumerate(order):
+        range_start = counted_before[starts[node]]
+        range_stop = counted_before[i]
+        older = 0
+        for child in children_of.get(node, ()):
+            child_older = older_descendants[child]
+            if position[child] >= starts[node]:
+                # Child was first reached through node, so its own range is already inside ours
+                if child_older:
+                    older |= child_older & ((1 << range_start) - 1)
+            else:
+                # Child was walked before node, so everything it counts is older than our range
+                child_start = counted_before[starts[child]]
+                child_stop = counted_before[position[child] + 1]
+                older |= child_older | (((1 << (child_stop - child_start)) - 1) << child_start)
+            unused_parents[child] -= 1
+            if unused_parents[child] == 0:
+                del older_descendants[child]
+        counts[node] = range_stop - range_start + _bit_count(older)
+        older_descendants[node] = older
+    return counts
+
+
+def _count_dag_generations(nodes, order, children_of):
+    """
+    Returns a dict of the longest path below each node, using the output of _walk_dag
+    """
+    depths = dict.fromkeys(nodes, 0)
+    for node in order:
+        for child in children_of.get(node, ()):
+            depths[node] = max(depths[node], depths[child] + 1)
+    return depths
+
+
+def _bit_count(x):
+    """
+    Returns the number of set bits in a non-negative int
+    """
+    try:
+        return x.bit_count()
+    except AttributeError:
+        # int.bit_count is only available in Python>=3.10
+        return bin(x).count('1')
+
+
+def _to_label_array(labels):
+    """
+    Returns labels as a numpy array, storing anything that is not already an array (eg a list) as an object array so
+    mixed label types (eg a '<ROOT>' string with integer nodes) are not coerced to a common type
+    """
+    if isinstance(labels, pd.Series):
+        return labels.to_numpy()
+    elif isinstance(labels, np.ndarray):
+        return labels
+    labels = list(labels)
+    array = np.empty(len(labels), dtype=object)
+    array[:] = labels
+    return array
+
+
+class CompiledTree:
+    def __init__(self, tree, this_level='<ROOT>'):
+        """
+        Compile a tree into integer-indexed NumPy arrays for fast, repeated analytics
+
+        Node labels are mapped to integer ids in level order (breadth first), so the root is id 0, every level of the
+        tree is a contiguous range of ids and the children of each node are a contiguous range of ids.  This lets the
+        tree be stored CSR-style as:
+            parents: parents[i] is the id of the parent of node i (-1 for the root)
+            child_offsets: children of node i are the ids child_offsets[i]:child_offsets[i+1]
+            level_offsets: nodes at level d (the root is level 0) are the ids level_offsets[d]:level_offsets[d+1]
+        Statistics are then computed with one vectorized reduction per level of the tree rather than a Python call per
+        node.
+
+        Args:
+            tree (dict): Tree defined as a dict of lists or dict of dicts (see count_leaves_of_tree)
+            this_level (str): Key of tree level to compile the tree from
+        """
+        labels = [this_level]
+        parents = [-1]
+        subtrees = [_LOOKUP]
+        visited = {this_level}
+        # labels grows as we go, so this is a breadth-first walk
+        for node_id, node in enumerate(labels):
+            children, child_subtrees = _get_children(tree, node, subtrees[node_id])
+            for child in children:
+                if child in visited:
+                    raise ValueError("Error: redundancy found in tree - two parents have the same child")
+                visited.add(child)
+                labels.append(child)
+                parents.append(node_id)
+            if child_subtrees is None:
+                subtrees.extend([_LOOKUP] * len(children))
+            else:
+                subtrees.extend(child_subtrees)
+
+        self._build(labels, np.asarray(parents, dtype=np.int64))
+
+    @classmethod
+    def from_edges(cls, parents, children, root='<ROOT>'):
+        """
+        Compile a tree from aligned arrays of (parent, child) edges without looping over the edges in Python
+
+        Labels are factorized into integer codes, edges are grouped by parent with a stable argsort and the tree is
+        then numbered level by level from root, so the Python-level work is one vectorized step per level.  Children of
+        a node keep the order they appear in the edges.  Only nodes that are reachable from root are kept.
+
+        Args:
+            parents (np.array or iterable): Parent label of each edge
+            children (np.array or iterable): Child label of each edge, aligned with parents
+            root: Label of the root of the tree.  If None, the root is the only parent that is never a child
+
+        Returns:
+            (CompiledTree)
+        """
+        parents = _to_label_array(parents)
+        children = _to_label_array(children)
+        if parents.shape != children.shape or parents.ndim != 1:
+            raise ValueError("parents and children must be 1-dimensional arrays of the same length")
+        n_edges = len(parents)
+
+        # Concatenate as object if the dtypes differ, so labels are not cast to a common type (eg ints to strings)
+        dtype = None if parents.dtype == children.dtype else object
+        codes, uniques = pd.factorize(np.concatenate((parents, children), dtype=dtype))
+        if np.any(codes < 0):
+            raise ValueError("Edges cannot contain missing labels")
+        parent_codes = codes[:n_edges]
+        child_codes = codes[n_edges:]
+        n_codes = len(uniques)
+
+        n_parents = np.bincount(child_codes, minlength=n_codes)
+        if np.any(n_parents > 1):
+            raise ValueError("Error: redundancy found in tree - two parents have the same child")
+
+        if root is None:
+            is_root = (n_parents == 0) & (np.bincount(parent_codes, minlength=n_codes) > 0)
+            root_codes = np.flatnonzero(is_root)
+            if len(root_codes) != 1:
+                raise ValueError(f"Cannot infer root - found {len(root_codes)} parents that are never a child")
+            root_code = root_codes[0]
+        else:
+            root_codes = np.flatnonzero(np.asarray(uniques) == root)
+            if len(root_codes) == 0:
+                # Like count_leaves_of_tree, a root that has no children is a tree of a single node
+                obj = cls.__new__(cls)
+                obj._build([root], np.array([-1], dtype=np.int64))
+                return obj
+            root_code = root_codes[0]
+            if n_parents[root_code] > 0:
+                raise ValueError(f"Error: redundancy found in tree - root {root} has a parent")
+
+        # CSR layout of the edges in code space
+        edge_order = np.argsort(parent_codes, kind='stable')
+        sorted_child_codes = child_codes[edge_order]
+        n_children = np.bincount(parent_codes, minlength=n_codes)
+        edge_offsets = np.zeros(n_codes + 1, dtype=np.int64)
+        np.cumsum(n_children, out=edge_offsets[1:])
+
+        # Number nodes level by level, so each level (and the children of each node) are contiguous ids
+        level_codes = [np.array([root_code])]
+        level_parents = [np.array([-1], dtype=np.int64)]
+        frontier = level_codes[0]
+        frontier_start = 0
+        while True:
+            frontier_n_children = n_children[frontier]
+            n_next = frontier_n_children.sum()
+            if n_next == 0:
+                break
+            # Gather the children of every frontier node with one fancy index
+            first_child = np.repeat(edge_offsets[frontier] - np.cumsum(frontier_n_children) + frontier_n_children,
+                                    frontier_n_children)
+            frontier = sorted_child_codes[first_child + np.arange(n_next)]
+            level_codes.append(frontier)
+            level_parents.append(np.repeat(np.arange(frontier_start, frontier_start + len(frontier_n_children)),
+                                           frontier_n_children))
+            frontier_start += len(frontier_n_children)
+
+        obj = cls.__new__(cls)
+        obj._build(np.asarray(uniques)[np.concatenate(level_codes)],
+                   np.concatenate(level_parents).astype(np.int64, copy=False))
+        return obj
+
+    @classmethod
+    def from_dataframe(cls, df, parent_column='parent', child_column='child', root='<ROOT>'):
+        """
+        Compile a tree from a DataFrame of (parent, child) edges (see CompiledTree.from_edges)
+
+        Args:
+            df (pd.DataFrame): DataFrame with one row per edge
+            parent_column (str): Name of the column in df holding the parent of each edge
+            child_column (str): Name of the column in df holding the child of each edge
+            root: Label of the root of the tree (see CompiledTree.from_edges)
+
+        Returns:
+            (CompiledTree)
+        """
+        return cls.from_edges(df.loc[:, parent_column].to_numpy(), df.loc[:, child_column].to_numpy(), root=root)
+
+    def _build(self, labels, parents):
+        """
+        Populate the compiled arrays from labels and parent ids that are already in level order
+
+        Labels given as a list are stored as an object array, so mixed label types are not coerced to a common type
+        """
+        n_nodes = len(parents)
+        if isinstance(labels, np.ndarray):
+            self.labels = labels
+        else:
+            self.labels = np.empty(n_nodes, dtype=object)
+            self.labels[:] = labels
+        self.parents = parents
+
+        n_children = np.bincount(parents[1:], minlength=n_nodes)
+        self.child_offsets = np.empty(n_nodes + 1, dtype=np.int64)
+        self.child_offsets[0] = 1
+        np.cumsum(n_children, out=self.child_offsets[1:])
+        self.child_offsets[1:] += 1
+
+        # The children of a contiguous level are the next contiguous level
+        level_offsets = [0, 1]
+        while level_offsets[-1] < n_nodes:
+            level_offsets.append(int(self.child_offsets[level_offsets[-1]]))
+        self.level_offsets = np.asarray(level_offsets, dtype=np.int64)
+
+        self._ids = None
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __contains__(self, label):
+        try:
+            self.id_of(label)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    @property
+    def n_levels(self):
+        """
+        Number of levels in the tree (a tree of only a root has 1 level)
+        """
+        return len(self.level_offsets) - 1
+
+    def id_of(self, label):
+        """
+        Returns the integer id of the node with the given label
+        """
+        if self._ids is None:
+            self._ids = {label: i for i, label in enumerate(self.labels)}
+        return self._ids[label]
+
+    def count_children(self):
+        """
+        Returns the number of first-generation descendants (children) of each node, indexed by node id
+
+        Returns:
+            (np.array): Array of counts aligned with self.labels
+        """
+        return np.diff(self.child_offsets)
+
+    def count_leaves(self, count_type='all'):
+        """
+        Returns the number of leaves under each node, indexed by node id
+
+        Args:
+            count_type (str): Specifies which type of count to be returned (see count_leaves_of_tree)
+
+        Returns:
+            (np.array): Array of counts aligned with self.labels
+        """
+        if count_type == 'first':
+            return self.count_children()
+        elif count_type == 'all':
+            return self._reduce_levels(np.add.at, lambda counts, nodes: counts[nodes] + 1)
+        elif count_type == 'last':
+            is_leaf = self.count_children() == 0
+            # Leaves contribute themselves, other nodes contribute the leaves under them
+            return self._reduce_levels(np.add.at, lambda counts, nodes: np.maximum(counts[nodes], is_leaf[nodes]))
+        else:
+            raise ValueError(f'Invalid count_type {count_type}')
+
+    def count_future_generations(self):
+        """
+        Returns the number of generations below each node, indexed by node id
+
+        Returns:
+            (np.array): Array of generation counts aligned with self.labels
+        """
+        return self._reduce_levels(np.maximum.at, lambda depths, nodes: depths[nodes] + 1)
+
+    @property
+    def root(self):
+        """
+        Label of the root of the tree
+        """
+        return self.labels[0]
+
+    def subtree_ids(self, label):
+        """
+        Returns the ids of the node with the given label and all nodes below it, in level order
+
+        As ids are numbered level by level, the descendants of a node at each level are a contiguous range of ids
+        """
+        start = self.id_of(label)
+        stop = start + 1
+        ranges = []
+        while start < stop:
+            ranges.append(np.arange(start, stop))
+            start, stop = self.child_offsets[start], self.child_offsets[stop]
+        return np.concatenate(ranges)
+
+    def statistics(self):
+        """
+        Returns all per-node statistics of the tree, using the same columns as tree_statistics
+
+        Returns:
+            (pd.DataFrame): DataFrame indexed by node label (in level order)
+        """
+        return pd.DataFrame(
+            {
+                'all': self.count_leaves('all'),
+                'first': self.count_leaves('first'),
+                'last': self.count_leaves('last'),
+                'generations': self.count_future_generations(),
+            },
+            index=pd.Index(self.labels),
+        )
+
+    def to_dict(self, values, ids=None):
+        """
+        Returns a dict of {label: value} from an array of values indexed by node id
+
+        Args:
+            values (np.array): Values aligned with self.labels
+            ids (np.array): (OPTIONAL) Ids of the nodes to include.  If None, all nodes are included
+        """
+        if ids is None:
+            return dict(zip(self.labels, values.tolist()))
+        return dict(zip(self.labels[ids], values[ids].tolist()))
+
+    def _reduce_levels(self, reduce_at, to_parent):
+        """
+        Reduces values from the bottom level of the tree up to the root
+
+        Args:
+            reduce_at: Unbuffered ufunc method (eg np.add.at) used to combine each child into its parent
+            to_parent: Function of (values, nodes) returning what the nodes (a slice of ids making up one level)
+                       contribute to their parents, given the final values of those nodes
+
+        Returns:
+            (np.array): Reduced values indexed by node id
+        """
+        values = np.zeros(len(self), dtype=np.int64)
+        for level in range(self.n_levels - 1, 0, -1):
+            nodes = slice(self.level_offsets[level], self.level_offsets[level + 1])
+            reduce_at(values, self.parents[nodes], to_parent(values, nodes))
+        return values
+
+
+class MutableTree:
+    def __init__(self, tree=None, this_level='<ROOT>'):
+        """
+        Construct a tree that keeps the statistics of every node up to date as the tree is modified
+
+        Each node tracks its all/first/last leaf counts (see count_leaves_of_tree) and its number of future generations
+        (see count_future_generations).  Adding, removing or moving a subtree only updates the ancestors of the changed
+        node (plus the nodes of the subtree being added or removed), and reading the statistics of a node is O(1).
+
+        Args:
+            tree (dict): (OPTIONAL) Tree defined as a dict of lists (see count_leaves_of_tree) to initialize from.  If
+                         None, the tree starts as only the root node this_level
+            this_level (str): Key of the root of the tree
+        """
+        self.root = this_level
+        self._parents = {}
+        # Children are stored as dict keys so they keep their order but can be removed in O(1)
+        self._children = {}
+        self._all_counts = {}
+        self._last_counts = {}
+        self._generations = {}
+        # Count of children by their number of future generations, used to update generations when children change
+        self._child_generations = {}
+
+        self._load(tree if tree is not None else {}, this_level, parent=None)
+
+    def __len__(self):
+        return len(self._parents)
+
+    def __contains__(self, node):
+        return node in self._parents
+
+    def parent(self, node):
+        """
+        Returns the parent of node (None for the root)
+        """
+        return self._parents[node]
+
+    def children(self, node):
+        """
+        Returns a list of the children of node
+        """
+        return list(self._children[node])
+
+    def count_leaves(self, node, count_type='all'):
+        """
+        Returns the number of leaves under node
+
+        Args:
+            node: Node to return the count for
+            count_type (str): Specifies which type of count to be returned (see count_leaves_of_tree)
+
+        Returns:
+            (int)
+        """
+        if count_type == 'all':
+            return self._all_counts[node]
+        elif count_type == 'first':
+            return len(self._children[node])
+        elif count_type == 'last':
+            return self._last_counts[node]
+        else:
+            raise ValueError(f'Invalid count_type {count_type}')
+
+    def count_future_generations(self, node):
+        """
+        Returns the number of generations below node
+        """
+        return self._generations[node]
+
+    def statistics(self, node):
+        """
+        Returns a dict of all statistics of node, using the same keys as the columns of tree_statistics
+        """
+        return {
+            'all': self._all_counts[node],
+            'first': len(self._children[node]),
+            'last': self._last_counts[node],
+            'generations': self._generations[node],
+        }
+
+    def to_dict(self, count_type='all'):
+        """
+        Returns a dict of {node: children_count} for all nodes, matching the output of count_leaves_of_tree
+        """
+        if count_type == 'first':
+            return {node: len(children) for node, children in self._children.items()}
+        return {node: self.count_leaves(node, count_type=count_type) for node in self._parents}
+
+    def add_node(self, node, parent):
+        """
+        Add a single node as a child of parent
+
+        Args:
+            node: Label of the new node.  Must not already be in the tree
+            parent: Label of an existing node to add the new node under
+
+        Returns:
+            None
+        """
+        self.add_subtree({}, parent, this_level=node)
+
+    def add_subtree(self, tree, parent, this_level='<ROOT>'):
+        """
+        Add a subtree (and all nodes below it) as a child of parent
+
+        Args:
+            tree (dict): Tree defined as a dict of lists (see count_leaves_of_tree).  None of its nodes may already be
+                         in this tree
+            parent: Label of an existing node to add the subtree under
+            this_level: Key of the root of the subtree in tree
+
+        Returns:
+            None
+        """
+        if parent not in self._parents:
+            raise KeyError(f"Parent {parent} is not in the tree")
+        self._load(tree, this_level, parent=parent)
+        self._attach(this_level, parent)
+
+    def remove_node(self, node):
+        """
+        Remove node and all nodes below it from the tree
+
+        Args:
+            node: Label of the node to remove.  Cannot be the root
+
+        Returns:
+            None
+        """
+        if node == self.root:
+            raise ValueError("Cannot remove the root of the tree")
+        self._detach(node)
+
+        stack = [node]
+        while stack:
+            this_node = stack.pop()
+            stack.extend(self._children.pop(this_node))
+            del self._parents[this_node]
+            del self._all_counts[this_node]
+            del self._last_counts[this_node]
+            del self._generations[this_node]
+            del self._child_generations[this_node]
+
+    def move_node(self, node, parent):
+        """
+        Move node (and all nodes below it) to be a child of parent
+
+        Args:
+            node: Label of the node to move.  Cannot be the root
+            parent: Label of the new parent of node.  Cannot be node itself or one of its descendants
+
+        Returns:
+            None
+        """
+        if node == self.root:
+            raise ValueError("Cannot move the root of the tree")
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor == node:
+                raise ValueError(f"Cannot move {node} under itself")
+            ancestor = self._parents[ancestor]
+        self._detach(node)
+        self._attach(node, parent)
+
+    def _load(self, tree, this_level, parent):
+        """
+        Add the nodes of a subtree to the tree without attaching the root of the subtree to its parent
+        """
+        nodes, children_of = _walk_tree(tree, this_level=this_level)
+        for node in nodes:
+            if node in self._parents:
                 raise ValueError("Error: redundancy found in tree - two parents have the same child")
-            depths.update(child_depths)
-            depths[this_level] = max(depths[this_level], depths[child] + 1)
+        all_counts, _, last_counts, generations = _accumulate_statistics(nodes, children_of)
+
+        self._parents[this_level] = parent
+        for node in nodes:
+            children = children_of.get(node, ())
+            self._children[node] = dict.fromkeys(children)
+            for child in children:
+                self._parents[child] = node
+            self._child_generations[node] = collections.Counter(generations[child] for child in children)
+        self._all_counts.update(all_counts)
+        self._last_counts.update(last_counts)
+        self._generations.update(generations)
+
+    def _attach(self, node, parent):
+        """
+        Attach the (already loaded) subtree at node to parent, updating the statistics of all ancestors of node
+        """
+        self._parents[node] = parent
+        parent_was_leaf = not self._children[parent]
+        self._children[parent][node] = None
+
+        size = self._all_counts[node] + 1
+        leaf_change = max(1, self._last_counts[node])
+        ancestor = parent
+        while ancestor is not None:
+            self._all_counts[ancestor] += size
+            self._last_counts[ancestor] += leaf_change
+            if parent_was_leaf and ancestor == parent:
+                # parent no longer counts as a leaf of its own ancestors
+                leaf_change -= 1
+            ancestor = self._parents[ancestor]
+
+        self._child_generations[parent][self._generations[node]] += 1
+        self._update_generations(parent)
+
+    def _detach(self, node):
+        """
+        Detach the subtree at node from its parent, updating the statistics of all ancestors of node
+        """
+        parent = self._parents[node]
+        del self._children[parent][node]
+        self._parents[node] = None
+        parent_is_leaf = not self._children[parent]
+
+        size = self._all_counts[node] + 1
+        leaf_change = max(1, self._last_counts[node])
+        ancestor = parent
+        while ancestor is not None:
+            self._all_counts[ancestor] -= size
+            self._last_counts[ancestor] -= leaf_change
+            if parent_is_leaf and ancestor == parent:
+                # parent now counts as a leaf of its own ancestors
+                leaf_change -= 1
+            ancestor = self._parents[ancestor]
+
+        child_generations = self._child_generations[parent]
+        child_generations[self._generations[node]] -= 1
+        if child_generations[self._generations[node]] == 0:
+            del child_generations[self._generations[node]]
+        self._update_generations(parent)
 
-        return depths
-    except (KeyError, TypeError):
-        return {this_level: 0}
+    def _update_generations(self, node):
+        """
+        Recompute the generations of node from its children, propagating upward only while the value changes
+        """
+        while node is not None:
+            child_generations = self._child_generations[node]
+            generations = max(child_generations) + 1 if child_generations else 0
+            old_generations = self._generations[node]
+            if generations == old_generations:
+                break
+            self._generations[node] = generations
 
+            parent = self._parents[node]
+            if parent is not None:
+                parent_child_generations = self._child_generations[parent]
+                parent_child_generations[old_generations] -= 1
+                if parent_child_generations[old_generations] == 0:
+                    del parent_child_generations[old_generations]
+                parent_child_generations[generations] += 1
+            node = parent
@@ -15,8 +15,12 @@ setup(name='general_utils',
         'numpy>=1.14.0',
         'pandas>=0.22.0',
         'scikit-learn>=0.19.1',
+        'scipy>=1.0.0',
         'six>=1.0.0'
       ],
+      extras_require={
+        'parquet': ['pyarrow'],
+      },
       packages=find_packages(),
       python_requires='>3.6',
       )
\ No newline at end of file
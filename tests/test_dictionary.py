@@ -0,0 +1,53 @@
+import pytest
+
+from general_utils.dictionary import dictionaries_intersect, find_key_collisions, iter_key_collisions
+
+
+@pytest.mark.parametrize(
+    "dictionaries, expected",
+    (
+        (({'a': 1}, {'b': 1}), False),
+        (({'a': 1, 'b': 2}, {'b': 1}), True),
+        (({'a': 1}, {'b': 1}, {'c': 1}), False),
+        (({'a': 1}, {'b': 1}, {'c': 1, 'a': 2}), True),
+        (({}, {}), False),
+    )
+)
+def test_dictionaries_intersect(dictionaries, expected):
+    assert expected == dictionaries_intersect(*dictionaries)
+
+
+def test_dictionaries_intersect_exception():
+    with pytest.raises(ValueError):
+        dictionaries_intersect({'a': 1})
+
+
+@pytest.mark.parametrize(
+    "dictionaries, expected",
+    (
+        ([{'a': 1}, {'b': 1}], {}),
+        ([{'a': 1, 'b': 2, 'c': 3}, {'b': 1}], {'b': [0, 1]}),
+        ([{'a': 1}, {'b': 1}, {'c': 1, 'a': 2}, {'a': 3, 'b': 3}], {'a': [0, 2, 3], 'b': [1, 3]}),
+    )
+)
+def test_find_key_collisions(dictionaries, expected):
+    assert expected == find_key_collisions(dictionaries)
+    # Also works on a stream of dictionaries
+    assert expected == find_key_collisions(d for d in dictionaries)
+
+
+def test_find_key_collisions_first_only():
+    dictionaries = [{'a': 1}, {'b': 1}, {'c': 1, 'a': 2}, {'a': 3, 'b': 3}]
+    assert {'a': [0, 2]} == find_key_collisions(dictionaries, first_only=True)
+
+
+def test_iter_key_collisions_stops_early():
+    consumed = []
+
+    def stream():
+        for i in range(100):
+            consumed.append(i)
+            yield {i % 3: i}
+
+    assert (0, 0, 3) == next(iter_key_collisions(stream()))
+    assert 4 == len(consumed)
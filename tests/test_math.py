@@ -1,7 +1,9 @@
 import pytest
 import numpy as np
+import pandas as pd
 
-from general_utils.math import cart_to_polar, polar_to_cart, floor_to, ceil_to, normalized_log
+from general_utils.math import cart_to_polar, polar_to_cart, cart_to_polar_chunked, polar_to_cart_chunked, floor_to, \
+    ceil_to, snap_to, normalized_log, ClassWeightAccumulator
 
 @pytest.mark.parametrize(
     "settings",
@@ -45,6 +47,59 @@ def test_cartToPolar_polarToCart(settings):
     assert tempxy == pytest.approx((settings['x'], settings['y']))
 
 
+@pytest.mark.parametrize("unit", ('deg', 'rad'))
+def test_cartToPolar_polarToCart_out(unit):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=100).astype(np.float32)
+    y = rng.normal(size=100).astype(np.float32)
+    r_expected, theta_expected = cart_to_polar(x, y, unit=unit)
+
+    out = (np.empty_like(x), np.empty_like(x))
+    r, theta = cart_to_polar(x, y, unit=unit, out=out)
+    assert r is out[0] and theta is out[1]
+    assert np.float32 == r.dtype
+    assert np.allclose(r_expected, r)
+    assert np.allclose(theta_expected, theta)
+
+    x_new, y_new = polar_to_cart(r, theta, unit=unit, out=(np.empty_like(x), np.empty_like(x)))
+    assert np.allclose(x, x_new, atol=1e-6)
+    assert np.allclose(y, y_new, atol=1e-6)
+
+
+@pytest.mark.parametrize("n_workers", (1, 3))
+@pytest.mark.parametrize("dtype", (np.float32, np.float64))
+def test_cartToPolar_polarToCart_chunked(n_workers, dtype):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=1000).astype(dtype)
+    y = rng.normal(size=1000).astype(dtype)
+
+    r, theta = cart_to_polar_chunked(x, y, chunk_size=64, n_workers=n_workers)
+    assert dtype == r.dtype
+    assert np.allclose(cart_to_polar(x, y), (r, theta))
+
+    x_new, y_new = polar_to_cart_chunked(r, theta, chunk_size=64, n_workers=n_workers)
+    assert np.allclose(polar_to_cart(r, theta), (x_new, y_new))
+
+    # A scalar input does not change the dtype of the outputs
+    x_new, y_new = polar_to_cart_chunked(2.0, theta, chunk_size=64, n_workers=n_workers)
+    assert dtype == x_new.dtype
+    assert np.allclose(polar_to_cart(2.0, theta), (x_new, y_new))
+
+
+def test_cartToPolar_polarToCart_chunked_npy(tmp_path):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(1000, 2))
+    y = rng.normal(size=(1000, 2))
+    np.save(tmp_path / 'x.npy', x)
+    np.save(tmp_path / 'y.npy', y)
+
+    cart_to_polar_chunked(tmp_path / 'x.npy', tmp_path / 'y.npy', unit='rad',
+                          out=(tmp_path / 'r.npy', tmp_path / 'theta.npy'), chunk_size=100)
+    r = np.load(tmp_path / 'r.npy')
+    theta = np.load(tmp_path / 'theta.npy')
+    assert np.allclose(cart_to_polar(x, y, unit='rad'), (r, theta))
+
+
 @pytest.mark.parametrize(
     "settings",
     [
@@ -77,8 +132,141 @@ def test_ceil_to(settings):
     assert ceil_to(settings['x'], settings['to_value']) == pytest.approx(settings['result'])
 
 
+@pytest.mark.parametrize(
+    "x, to_value, how, expected",
+    (
+        (1.27, 0.1, 'floor', 1.2),
+        (1.3, 0.05, 'floor', 1.3),
+        (1.2, 0.1, 'ceil', 1.2),
+        (1.21, 0.1, 'ceil', 1.3),
+        (0.7, 0.1, 'ceil', 0.7),
+        (1.225, 0.05, 'round', 1.25),
+        (-1.225, 0.05, 'round', -1.2),
+        (1.26, 0.05, 'round', 1.25),
+        (7, 2, 'floor', 6),
+    )
+)
+def test_snap_to_exact(x, to_value, how, expected):
+    # Exact comparison on purpose - results should be the float nearest to the true multiple
+    assert expected == snap_to(x, to_value, how=how)
+
+
+@pytest.mark.parametrize("how", ('floor', 'ceil', 'round'))
+def test_snap_to_array(how):
+    x = np.array([-1.27, 0.0, 0.05, 1.27, 1.3, 2.499])
+    expected = np.array([snap_to(value, 0.05, how=how) for value in x])
+    assert np.all(expected == snap_to(x, 0.05, how=how, chunk_size=4))
+
+    index = snap_to(x, 0.05, how=how, return_index=True)
+    assert np.int64 == index.dtype
+    assert np.allclose(expected, index * 0.05)
+
+    result = snap_to(pd.Series(x, index=list('abcdef')), 0.05, how=how)
+    assert list('abcdef') == list(result.index)
+    assert np.all(expected == result.values)
+
+
+def test_snap_to_out():
+    x = np.array([0.3, 0.71], dtype=np.float32)
+    out = np.empty_like(x)
+    result = snap_to(x, 0.1, how='ceil', out=out)
+    assert result is out
+    assert np.all(np.array([0.3, 0.8], dtype=np.float32) == out)
+
+
+@pytest.mark.parametrize(
+    "how, expected_index",
+    (
+        ('floor', [1_700_000_000_999_999, -1_700_000_001_000_000, 1_700_000_001_000_000]),
+        ('ceil', [1_700_000_001_000_000, -1_700_000_000_999_999, 1_700_000_001_000_000]),
+        ('round', [1_700_000_001_000_000, -1_700_000_000_999_999, 1_700_000_001_000_000]),
+    )
+)
+def test_snap_to_integer(how, expected_index):
+    # Nanosecond timestamps do not fit exactly in a float64
+    x = np.array([1_700_000_000_999_999_999, -1_700_000_000_999_999_500, 1_700_000_001_000_000_000])
+    index = snap_to(x, 1000, how=how, return_index=True)
+    assert expected_index == index.tolist()
+    result = snap_to(x, 1000, how=how)
+    assert np.int64 == result.dtype
+    assert (index * 1000).tolist() == result.tolist()
+
+
+def test_snap_to_small_integer_dtype():
+    # Results are int64, so snapping past the range of the input dtype does not wrap around
+    x = np.array([255, 3], dtype=np.uint8)
+    result = snap_to(x, 2, how='ceil')
+    assert np.int64 == result.dtype
+    assert [256, 4] == result.tolist()
+
+
+@pytest.mark.parametrize(
+    "x, to_value, expected",
+    (
+        (7, 2, 6),
+        (7, 0.5, 7.0),
+        (7, 2.0, 6.0),
+    )
+)
+def test_floor_to_integer(x, to_value, expected):
+    result = floor_to(x, to_value)
+    assert expected == result
+    assert isinstance(expected, int) == isinstance(result, (int, np.integer))
+
+
+def test_snap_to_float32():
+    # Beyond 2**24 multiples of to_value, float32 can't hold the index, but values already on the float32 grid should
+    # still be unchanged
+    x = np.array([-922128.9375, 1e7 + 1, 3.3e7], dtype=np.float32)
+    assert np.all(x == snap_to(x, 0.05))
+    assert np.all(x == snap_to(x, 0.05, how='ceil'))
+    for how in ('floor', 'ceil'):
+        index = snap_to(x, 0.05, how=how, return_index=True)
+        assert np.int64 == index.dtype
+        assert np.all(x == (index / 20).astype(np.float32))
+    assert -18442579 == snap_to(x[0], 0.05, return_index=True)
+
+
+def test_snap_to_nan():
+    x = np.array([1.27, np.nan])
+    assert np.isnan(snap_to(x, 0.1)[1])
+    with pytest.raises(ValueError):
+        snap_to(x, 0.1, return_index=True)
+
+
 def test_normalized_log():
     x = [1, 2, 3]
     y = np.array((np.log(2), np.log(3), np.log(4))) / np.sum((np.log(2), np.log(3), np.log(4)))
 
     assert np.all(y == normalized_log(x))
+
+
+def test_class_weight_accumulator():
+    accumulator = ClassWeightAccumulator()
+    accumulator.update(['a', 'b', 'a'])
+    accumulator.update_counts(pd.Series({'a': 1, 'c': 2}))
+
+    weights = accumulator.weights()
+    assert ['a', 'b', 'c'] == list(weights.index)
+    assert np.allclose(normalized_log([3, 1, 2]), weights.values)
+
+
+def test_class_weight_accumulator_groups():
+    accumulator = ClassWeightAccumulator()
+    accumulator.update(['a', 'b', 'a', 'c'], groups=['g1', 'g1', 'g2', 'g1'])
+    accumulator.update(['a', 'a'], group='g2')
+
+    other = ClassWeightAccumulator()
+    other.update(['b'], group='g3')
+    accumulator.merge(other)
+
+    assert ['g1', 'g2', 'g3'] == accumulator.groups
+    assert np.allclose(normalized_log([1, 1, 1]), accumulator.weights('g1').values)
+    assert np.allclose(normalized_log([3]), accumulator.weights('g2').values)
+
+    table = accumulator.weights_table()
+    assert ['g1', 'g2', 'g3'] == list(table.index)
+    for group in table.index:
+        weights = accumulator.weights(group)
+        assert np.allclose(weights.values, table.loc[group, weights.index].values)
+        assert 0 == table.loc[group].drop(weights.index).sum()
@@ -1,7 +1,8 @@
 import pytest
 import numpy as np
 
-from general_utils.numpy import get_length_from_unicode_dtype, safe_insert_string
+from general_utils.numpy import get_length_from_unicode_dtype, safe_insert_string, safe_insert_strings, \
+    StringArrayBuilder, StringColumn
 
 
 @pytest.mark.parametrize(
@@ -39,3 +40,111 @@ def test_get_length_from_unicode_dtype_exception(dtype):
 def test_safe_insert_string(a, index, val, a_expected):
     a_new = safe_insert_string(a, index, val)
     assert np.all(a_expected == a_new)
+
+
+@pytest.mark.parametrize(
+    "a, index, vals, a_expected",
+    (
+        (np.array(('a', 'b', 'c')), [0, 2], ['aaa', 'c'], np.array(('aaa', 'b', 'c'))),
+        (np.array(('a', 'b', 'c')), np.array([True, False, True]), ['x', 'yy'], np.array(('x', 'b', 'yy'))),
+        (np.array(('a', 'b', 'c')), slice(1, None), 'xxx', np.array(('a', 'xxx', 'xxx'))),
+        (np.array(('a', 'b', 'c')), [(0, 'aaa'), (1, 12)], None, np.array(('aaa', '12', 'c'))),
+        (np.array((('a', 'b'), ('c', 'd'))), [((0, 1), 'xx'), ((1, 0), 'y')], None,
+         np.array((('a', 'xx'), ('y', 'd')))),
+    )
+)
+def test_safe_insert_strings(a, index, vals, a_expected):
+    a_original = a.copy()
+    a_new = safe_insert_strings(a, index, vals)
+    assert np.all(a_expected == a_new)
+    assert np.all(a_original == a)
+
+
+@pytest.mark.parametrize(
+    "vals, expect_inplace",
+    (
+        (['x', 'y'], True),
+        (['x', 'yyyy'], False),
+    )
+)
+def test_safe_insert_strings_inplace(vals, expect_inplace):
+    a = np.array(('aa', 'bb', 'cc'))
+    a_new = safe_insert_strings(a, [0, 1], vals, inplace=True)
+    assert expect_inplace == (a_new is a)
+    assert np.all(np.array(vals + ['cc']) == a_new)
+
+
+def test_string_array_builder():
+    builder = StringArrayBuilder(capacity=2, length=1)
+    expected = []
+    for i in range(100):
+        builder.append('x' * (i % 7))
+        expected.append('x' * (i % 7))
+    builder.extend(['abcdefghij', 1.5])
+    builder.append(12)
+    expected.extend(['abcdefghij', '1.5', '12'])
+
+    a = builder.to_array()
+    assert len(expected) == len(builder)
+    assert np.dtype('U10') == a.dtype
+    assert np.all(np.array(expected) == a)
+
+
+def test_string_array_builder_empty():
+    a = StringArrayBuilder().to_array()
+    assert 0 == len(a)
+    assert 'U' == a.dtype.char
+
+
+STRINGS = np.array(['héllo', '', 'abc', 'abc', 'zz', '日本語', 'a' * 50, 'héllo'])
+
+
+def test_string_column_round_trip():
+    column = StringColumn.from_array(STRINGS, chunk_size=3)
+    assert len(STRINGS) == len(column)
+    assert column.nbytes < STRINGS.nbytes
+    assert STRINGS.dtype == column.to_array().dtype
+    assert np.all(STRINGS == column.to_array())
+    assert '日本語' == column[5]
+    assert 'héllo' == column[-1]
+
+
+@pytest.mark.parametrize(
+    "key",
+    (
+        [0, -1, 3],
+        slice(2, 5),
+        slice(None, None, 3),
+        np.array([True, False] * 4),
+    )
+)
+def test_string_column_take(key):
+    column = StringColumn.from_array(STRINGS)
+    assert STRINGS[key].tolist() == column[key].tolist()
+
+
+def test_string_column_setitem():
+    column = StringColumn.from_array(STRINGS)
+    expected = STRINGS.astype('U50')
+    column[[1, 3]] = ['a new longer string', 'x']
+    expected[[1, 3]] = ['a new longer string', 'x']
+    column[2:4] = 'Ω'
+    expected[2:4] = 'Ω'
+    assert expected.tolist() == column.tolist()
+
+
+def test_string_column_compare():
+    column = StringColumn.from_array(STRINGS)
+    other = STRINGS.copy()
+    other[[1, 4]] = ['q', 'zz']
+    assert np.all((STRINGS == 'abc') == (column == 'abc'))
+    assert np.all((STRINGS == '') == (column == ''))
+    assert np.all((STRINGS == other) == (column == StringColumn.from_array(other)))
+    assert np.all((STRINGS != other) == (column != other))
+
+
+def test_string_column_unique():
+    unique, inverse = StringColumn.from_array(STRINGS).unique(return_inverse=True)
+    expected_unique, expected_inverse = np.unique(STRINGS, return_inverse=True)
+    assert expected_unique.tolist() == unique.tolist()
+    assert np.all(expected_inverse.ravel() == inverse)
@@ -1,8 +1,9 @@
 import pytest
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
-from general_utils.pandas import get_zero_axes
+from general_utils.pandas import get_zero_axes, get_zero_axes_chunked, safe_astype, safe_astype_frame
 
 from contextlib import contextmanager
 
@@ -84,7 +85,8 @@ def test_get_zero_axes(build_random_df, isclose_kwargs, axis, expected):
     print(df)
 
     with expected['raises']:
-        zero_names, zero_indices, row_sums = get_zero_axes(df, return_sums=True, isclose_kwargs=isclose_kwargs, axis=axis)
+        zero_names, zero_indices, row_sums = get_zero_axes(df, return_sums=True, isclose_kwargs=isclose_kwargs,
+                                                           axis=axis)
 
         print(zero_names)
         assert np.all(expected['zero_names'] == zero_names)
@@ -92,3 +94,150 @@ def test_get_zero_axes(build_random_df, isclose_kwargs, axis, expected):
         assert np.all(expected['row_sums'] == pytest.approx(row_sums))
 
 # NOTE: return_sums argument for get_zero_axes is not captured in this test suite
+
+
+@pytest.mark.parametrize(
+    "data, dtype, always_convert_to_object, expected, expected_dtype",
+    (
+        ([1.0, np.nan, 3.0], str, True, ['1.0', np.nan, '3.0'], object),
+        ([1.0, np.nan, 3.0], int, False, [1, np.nan, 3], object),
+        ([1.0, 2.0], int, False, [1, 2], np.int64),
+        ([1.0, 2.0], int, True, [1, 2], object),
+    )
+)
+def test_safe_astype(data, dtype, always_convert_to_object, expected, expected_dtype):
+    ds = pd.Series(data, index=list('abcd')[:len(data)], name='x')
+    converted = safe_astype(ds, dtype, always_convert_to_object=always_convert_to_object)
+    assert expected_dtype == converted.dtype
+    assert ds.index.equals(converted.index)
+    assert 'x' == converted.name
+    assert pd.Series(expected, dtype=object).equals(pd.Series(converted.tolist(), dtype=object))
+    # Original is not modified
+    assert data == pytest.approx(ds.tolist(), nan_ok=True)
+
+
+def test_safe_astype_converts_from_object():
+    # Entries are converted from their object values, so timestamps keep their full string format
+    ds = pd.Series(pd.to_datetime(['2020-01-01', None]))
+    assert '2020-01-01 00:00:00' == safe_astype(ds, str)[0]
+    assert '0.10000000149011612' == safe_astype(pd.Series([0.1], dtype=np.float32), str)[0]
+    with pytest.raises(TypeError):
+        safe_astype(ds, int)
+
+
+@pytest.mark.parametrize(
+    "data, dtype, expected_dtype",
+    (
+        ([1.0, np.nan, 3.0], int, 'Int64'),
+        ([1.0, np.nan, 3.0], 'uint8', 'UInt8'),
+        ([1.0, np.nan, 3.0], float, 'Float64'),
+        ([1.0, np.nan, 3.0], str, 'string'),
+        ([1.0, np.nan, 0.0], bool, 'boolean'),
+        # Falls back to object when the nullable conversion is not possible
+        ([1.5, np.nan, 3.0], int, object),
+        # Falls back to object when there is no nullable equivalent of dtype
+        ([1.5, np.nan, 3.0], 'float16', object),
+        ([1.5, np.nan, 3.0], np.longdouble, object),
+    )
+)
+def test_safe_astype_nullable(data, dtype, expected_dtype):
+    ds = pd.Series(data)
+    converted = safe_astype(ds, dtype, nullable=True)
+    assert expected_dtype == converted.dtype
+    assert [False, True, False] == converted.isna().tolist()
+
+
+@pytest.mark.parametrize("n_workers", (1, 3))
+@pytest.mark.parametrize("always_convert_to_object", (True, False))
+@pytest.mark.parametrize("nullable", (True, False))
+def test_safe_astype_frame(n_workers, always_convert_to_object, nullable):
+    df = pd.DataFrame({
+        'a': [1.0, np.nan, 3.0],
+        'b': [1.0, 2.0, 3.0],
+        'c': ['x', None, 'z'],
+        'd': [1.5, 2.0, np.nan],
+        'e': [1, 2, 3],
+        'f': [True, False, True],
+    }, index=['p', 'q', 'r'])
+    dtypes = {'a': int, 'b': int, 'c': str, 'd': int, 'f': float}
+
+    converted = safe_astype_frame(df, dtypes, always_convert_to_object=always_convert_to_object, nullable=nullable,
+                                  n_workers=n_workers)
+    expected = pd.concat([safe_astype(df[column], dtypes[column], always_convert_to_object=always_convert_to_object,
+                                      nullable=nullable) if column in dtypes else df[column]
+                          for column in df.columns], axis=1)
+    assert list(df.columns) == list(converted.columns)
+    assert df.index.equals(converted.index)
+    assert expected.dtypes.equals(converted.dtypes)
+    for column in df.columns:
+        assert [repr(x) for x in expected[column]] == [repr(x) for x in converted[column]]
+
+
+def test_safe_astype_frame_no_nullable_equivalent():
+    # float16 has no nullable dtype, so columns converted to it fall back to object as in safe_astype
+    df = pd.DataFrame({'a': [1.5, np.nan], 'b': [1, 2]})
+    converted = safe_astype_frame(df, {'a': 'float16'}, nullable=True)
+    assert object == converted['a'].dtype
+    assert [np.float16(1.5), np.nan] == pytest.approx(converted['a'].tolist(), nan_ok=True)
+    assert df['b'].equals(converted['b'])
+
+
+@pytest.mark.parametrize("convert", (safe_astype, lambda ds, dtype: safe_astype_frame(ds.to_frame(), dtype)))
+def test_safe_astype_overflow(convert):
+    with pytest.raises(OverflowError):
+        convert(pd.Series([1.5, 1e20]), int)
+
+
+@pytest.mark.parametrize("axis", (0, 1))
+@pytest.mark.parametrize("n_workers", (1, 2))
+@pytest.mark.parametrize("from_csv", (True, False))
+def test_get_zero_axes_chunked(build_random_df, tmp_path, axis, n_workers, from_csv):
+    df = build_random_df
+    if from_csv:
+        source = tmp_path / 'df.csv'
+        df.to_csv(source)
+    else:
+        source = (df.iloc[i:i + 2] for i in range(0, len(df), 2))
+
+    zero_names, zero_indices, row_sums = get_zero_axes(df, return_sums=True, axis=axis)
+    chunked_names, chunked_indices, chunked_sums = get_zero_axes_chunked(source, return_sums=True, axis=axis,
+                                                                         chunksize=2, n_workers=n_workers)
+    assert np.all(zero_names == chunked_names)
+    assert np.all(zero_indices == chunked_indices)
+    assert list(row_sums.index) == list(chunked_sums.index)
+    assert np.all(row_sums.values == pytest.approx(chunked_sums.values))
+
+
+@pytest.mark.parametrize("axis", (0, 1))
+def test_get_zero_axes_chunked_parquet(build_random_df, tmp_path, axis):
+    pytest.importorskip('pyarrow')
+    df = build_random_df
+    source = tmp_path / 'df.parquet'
+    df.to_parquet(source)
+
+    zero_names, zero_indices, row_sums = get_zero_axes(df, return_sums=True, axis=axis)
+    chunked_names, chunked_indices, chunked_sums = get_zero_axes_chunked(source, return_sums=True, axis=axis,
+                                                                         chunksize=2)
+    assert np.all(zero_names == chunked_names)
+    assert np.all(zero_indices == chunked_indices)
+    assert list(row_sums.index) == list(chunked_sums.index)
+    assert np.all(row_sums.values == pytest.approx(chunked_sums.values))
+
+
+@pytest.mark.parametrize("axis", (0, 1))
+def test_get_zero_axes_sparse(build_random_df, axis):
+    df = build_random_df
+    zero_names, zero_indices, row_sums = get_zero_axes(df, return_sums=True, axis=axis)
+
+    sparse_df = df.astype(pd.SparseDtype(float, 0.0))
+    sparse_names, sparse_indices, sparse_sums = get_zero_axes(sparse_df, return_sums=True, axis=axis)
+    assert np.all(zero_names == sparse_names)
+    assert np.all(zero_indices == sparse_indices)
+    assert row_sums.index.equals(sparse_sums.index)
+
+    # scipy.sparse matrices name rows and columns by their integer index
+    matrix_names, matrix_indices, matrix_sums = get_zero_axes(scipy.sparse.csr_matrix(df.values), return_sums=True,
+                                                              axis=axis)
+    assert np.all(zero_indices == matrix_names)
+    assert np.all(zero_indices == matrix_indices)
+    assert np.all(row_sums.values == pytest.approx(matrix_sums.values))
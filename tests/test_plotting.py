@@ -0,0 +1,239 @@
+import pytest
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from general_utils.plotting import _compute_confusion_matrix_data, _get_heatmap_grid, compute_confusion_matrices, \
+    _get_first_occurrences, _get_worst_classes_counts, ConfusionMatrixAccumulator, heatmap, heatmap_from_df, \
+    plot_confusion_matrix
+
+
+Y_TRUE = np.array(['a', 'a', 'a', 'b', 'b', 'c', 'c', 'c', 'c', 'd'])
+Y_PRED = np.array(['a', 'b', 'a', 'b', 'e', 'c', 'a', 'c', 'c', 'a'])
+
+
+@pytest.mark.parametrize("normalize", (True, False))
+@pytest.mark.parametrize("sort", (True, False))
+@pytest.mark.parametrize("remove_if_better_than", (False, 0.6))
+def test_compute_confusion_matrix_data_sparse(normalize, sort, remove_if_better_than):
+    kwargs = dict(normalize=normalize, sort=sort, remove_if_better_than=remove_if_better_than)
+    dense = _compute_confusion_matrix_data(Y_TRUE, Y_PRED, **kwargs)
+    sparse = _compute_confusion_matrix_data(Y_TRUE, Y_PRED, sparse=True, **kwargs)
+
+    assert np.array_equal(dense['cm'], sparse['cm'].toarray())
+    for key in ('xticklabels', 'yticklabels', 'classes_shown_on_x', 'classes_shown_on_y'):
+        assert list(dense[key]) == list(sparse[key])
+
+
+def test_compute_confusion_matrix_data_sort():
+    data = _compute_confusion_matrix_data(Y_TRUE, Y_PRED, sparse=True)
+    # Sorted from worst to best classified, with predicted-only classes after the true ones
+    assert ['d', 'b', 'a', 'c'] == list(data['classes_shown_on_y'])
+    assert ['d', 'b', 'a', 'c', 'e'] == list(data['classes_shown_on_x'])
+    assert [0.0, 0.5, 2 / 3, 0.75] == pytest.approx(data['cm'].diagonal())
+
+
+@pytest.mark.parametrize(
+    "y_true, y_pred",
+    (
+        (Y_TRUE, Y_PRED),
+        ([3, 1, 2, 2, 1], [1, 5, 2, 2, 3]),
+    )
+)
+@pytest.mark.parametrize("engine", ('auto', 'bincount'))
+def test_compute_confusion_matrix_data_engine(y_true, y_pred, engine):
+    expected = _compute_confusion_matrix_data(y_true, y_pred, engine='sklearn', sort=False)
+    data = _compute_confusion_matrix_data(y_true, y_pred, engine=engine, sort=False)
+    assert np.array_equal(expected['cm'], data['cm'])
+    assert list(expected['classes_shown_on_x']) == list(data['classes_shown_on_x'])
+    assert list(expected['classes_shown_on_y']) == list(data['classes_shown_on_y'])
+
+
+@pytest.mark.parametrize("engine", ('bincount', 'numba'))
+def test_compute_confusion_matrix_data_engine_exception(engine):
+    # bincount cannot factorize missing labels
+    with pytest.raises(ValueError):
+        _compute_confusion_matrix_data(np.array([1.0, np.nan, 2.0]), np.array([1.0, 2.0, 2.0]), engine=engine)
+
+
+@pytest.mark.parametrize("engine", ('auto', 'bincount', 'sklearn'))
+def test_compute_confusion_matrix_data_mixed_label_types(engine):
+    # Int and str labels must not be cast to one type and silently compared as equal
+    with pytest.raises(ValueError):
+        _compute_confusion_matrix_data(np.array([1, 2, 2]), np.array(['1', '2', '1']), engine=engine)
+
+
+def test_confusion_matrix_accumulator():
+    accumulator = ConfusionMatrixAccumulator()
+    other = ConfusionMatrixAccumulator()
+    for start in range(0, len(Y_TRUE), 3):
+        accumulator.update(Y_TRUE[start:start + 3], Y_PRED[start:start + 3])
+        other.update(Y_PRED[start:start + 3], Y_TRUE[start:start + 3])
+    assert ['a', 'b', 'c', 'e', 'd'] == accumulator.classes
+
+    counts = accumulator.counts(['a', 'b', 'z'])
+    assert [[2, 1, 0], [0, 1, 0], [0, 0, 0]] == counts.values.tolist()
+
+    # Merging the transposed counts gives a symmetric matrix
+    accumulator.merge(other)
+    counts = accumulator.counts()
+    assert np.array_equal(counts.values, counts.values.T)
+
+
+def test_confusion_matrix_accumulator_label_types():
+    # Labels keep their type across batches, so int 1 and str '1' are different classes
+    accumulator = ConfusionMatrixAccumulator()
+    accumulator.update([1, 2], [1, 2])
+    accumulator.update([1], ['x'])
+    accumulator.update(['1'], [1])
+    assert [1, 2, 'x', '1'] == accumulator.classes
+    assert [[1, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 0], [1, 0, 0, 0]] == accumulator.counts().values.tolist()
+
+
+@pytest.mark.parametrize("sparse", (True, False))
+def test_compute_confusion_matrix_data_accumulator(sparse):
+    accumulator = ConfusionMatrixAccumulator()
+    accumulator.update(Y_TRUE[:5], Y_PRED[:5])
+    accumulator.update(Y_TRUE[5:], Y_PRED[5:])
+
+    expected = _compute_confusion_matrix_data(Y_TRUE, Y_PRED)
+    data = _compute_confusion_matrix_data(accumulator, sparse=sparse)
+    assert np.array_equal(expected['cm'], data['cm'].toarray() if sparse else data['cm'])
+    for key in ('xticklabels', 'yticklabels', 'classes_shown_on_x', 'classes_shown_on_y'):
+        assert list(expected[key]) == list(data[key])
+
+    with pytest.raises(ValueError):
+        _compute_confusion_matrix_data(accumulator, Y_PRED)
+
+
+@pytest.mark.parametrize("remove_if_better_than", (False, 0.6))
+def test_compute_confusion_matrices(remove_if_better_than):
+    y_preds = np.stack((Y_PRED, Y_TRUE, Y_PRED[::-1]))
+    result = compute_confusion_matrices(Y_TRUE, y_preds, remove_if_better_than=remove_if_better_than)
+
+    assert ['a', 'b', 'c', 'd', 'e'] == list(result['classes'])
+    assert (3, 5, 5) == result['counts'].shape
+    assert [[2 / 3, 0.5, 0.75, 0, 0], [1, 1, 1, 1, 0]] == pytest.approx(result['accuracy'][:2])
+    for y_pred, data in zip(y_preds, result['data']):
+        expected = _compute_confusion_matrix_data(Y_TRUE, y_pred, remove_if_better_than=remove_if_better_than)
+        assert np.array_equal(expected['cm'], data['cm'])
+        assert list(expected['classes_shown_on_y']) == list(data['classes_shown_on_y'])
+        assert list(expected['classes_shown_on_x']) == list(data['classes_shown_on_x'])
+
+    # Int and str labels are not compared as equal
+    with pytest.raises(ValueError):
+        compute_confusion_matrices(np.array([1, 2, 2]), np.array([['1', '2', '1']]))
+
+
+SWEEP = pd.DataFrame({
+    'x': [2.0, 1.0, 2.0, 1.0, 2.0, 2.0],
+    'y': [0.5, 0.5, 0.1, 0.1, 0.5, 0.9],
+    'z': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+})
+
+
+@pytest.mark.parametrize(
+    "aggfunc, expected",
+    (
+        ('mean', [[3.0, 2.0], [3.0, 4.0], [6.0, -1.0]]),
+        ('sum', [[6.0, 2.0], [3.0, 4.0], [6.0, -1.0]]),
+        ('count', [[2.0, 1.0], [1.0, 1.0], [1.0, -1.0]]),
+    )
+)
+def test_get_heatmap_grid(aggfunc, expected):
+    grid, x_all, y_all = _get_heatmap_grid(SWEEP, 'x', 'y', 'z', fill_value=-1, aggfunc=aggfunc)
+    # Axes follow the order of appearance, like Series.unique()
+    assert [2.0, 1.0] == list(x_all)
+    assert [0.5, 0.1, 0.9] == list(y_all)
+    assert expected == grid.tolist()
+
+
+def test_get_heatmap_grid_duplicates():
+    grid, _, _ = _get_heatmap_grid(SWEEP.iloc[1:], 'x', 'y', 'z')
+    assert [[2.0, 5.0], [4.0, 3.0], [6.0]] == [row[~np.isnan(row)].tolist() for row in grid]
+    with pytest.raises(ValueError):
+        _get_heatmap_grid(SWEEP, 'x', 'y', 'z')
+
+
+@pytest.mark.parametrize(
+    "max_annotated_cells, expected_texts",
+    (
+        (None, 9),
+        (9, 9),
+        (8, 0),
+    )
+)
+def test_heatmap_annotations(max_annotated_cells, expected_texts):
+    data = np.arange(9).reshape(3, 3) / 10
+    fig, ax = heatmap(data, [1, 2, 3], [4, 5, 6], max_annotated_cells=max_annotated_cells,
+                      rasterize_annotations=True)
+    assert expected_texts == len(ax.texts)
+    if expected_texts:
+        assert ['0.00', '0.10'] == [t.get_text() for t in ax.texts[:2]]
+        assert 'bold' == ax.texts[-1].get_fontweight()
+        assert ax.texts[0].get_rasterized()
+    plt.close(fig)
+
+
+def test_heatmap_from_df_missing_combination():
+    df = pd.DataFrame({'x': [1, 1, 2], 'y': [1, 2, 1], 'z': [0.5, 0.25, 0.75]})
+    ax = heatmap_from_df(df, 'x', 'y', 'z')
+    # The missing (x=2, y=2) cell is not annotated, and the max is still highlighted
+    texts = {t.get_text(): t.get_fontweight() for t in ax.texts}
+    assert {'0.500', '0.250', '0.750'} == set(texts)
+    assert 'bold' == texts['0.750']
+    plt.close('all')
+
+
+def test_plot_confusion_matrix_annotations():
+    ax = plot_confusion_matrix(Y_TRUE, Y_PRED, normalize=False)
+    cm = _compute_confusion_matrix_data(Y_TRUE, Y_PRED, normalize=False)['cm']
+    assert np.count_nonzero(cm >= 1) == len(ax.texts)
+    assert 1 == len(ax.collections)
+    assert 4 == len(ax.collections[0].get_paths())
+    plt.close('all')
+
+
+@pytest.mark.parametrize(
+    "max_classes, expected_classes, expected_counts",
+    (
+        (2, ['b', 'd', 'other'], [[1, 0, 1], [0, 0, 1], [1, 0, 6]]),
+        (3, ['a', 'b', 'd', 'other'], [[2, 1, 0, 0], [0, 1, 0, 1], [1, 0, 0, 0], [1, 0, 0, 3]]),
+        (10, ['a', 'b', 'c', 'd', 'e'], None),
+    )
+)
+def test_get_worst_classes_counts(max_classes, expected_classes, expected_counts):
+    accumulator, classes = _get_worst_classes_counts(Y_TRUE, Y_PRED, max_classes=max_classes)
+    assert expected_classes == list(classes)
+    if expected_counts is not None:
+        assert expected_counts == accumulator.counts(classes).to_numpy().tolist()
+    assert len(Y_TRUE) == accumulator.counts().to_numpy().sum()
+
+
+def test_get_worst_classes_counts_exception():
+    with pytest.raises(ValueError):
+        _get_worst_classes_counts(Y_TRUE, Y_PRED, max_classes=2, other_label='a')
+
+
+def test_plot_confusion_matrix_max_classes():
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 500, 20000)
+    y_pred = np.where(rng.random(len(y_true)) < 0.8, y_true, rng.integers(0, 500, len(y_true)))
+
+    ax = plot_confusion_matrix(y_true, y_pred, max_classes=10)
+    assert 11 == len(ax.get_yticklabels())
+    assert 'other' in [t.get_text() for t in ax.get_yticklabels()]
+    assert ax.images[0].get_rasterized()
+
+    ax = plot_confusion_matrix(y_true, y_pred, max_classes=400)
+    assert len(ax.get_yticklabels()) <= 60
+    assert 0 == len(ax.texts)
+    plt.close('all')
+
+
+def test_get_first_occurrences():
+    codes = np.array([2, 0, 2, 2, 0, 4])
+    assert [1, -1, 0, -1, 5] == _get_first_occurrences(codes, 5).tolist()
+    assert [-1, -1] == _get_first_occurrences(np.array([], dtype=np.int64), 2).tolist()
@@ -0,0 +1,311 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from general_utils.trees import count_leaves_of_tree, count_future_generations, tree_statistics, \
+    tree_statistics_from_events, CompiledTree, MutableTree
+
+
+@pytest.fixture
+def build_tree():
+    tree = {
+        '<ROOT>': ['1', '2'],
+        '1': ['11', '12'],
+        '2': ['21', '22', '23'],
+        '23': {'231', '232'},
+    }
+    return tree
+
+
+@pytest.mark.parametrize(
+    "count_type, expected",
+    (
+        ('all', {'<ROOT>': 9, '1': 2, '11': 0, '12': 0, '2': 5, '21': 0, '22': 0, '23': 2, '231': 0, '232': 0}),
+        ('first', {'<ROOT>': 2, '1': 2, '11': 0, '12': 0, '2': 3, '21': 0, '22': 0, '23': 2, '231': 0, '232': 0}),
+        ('last', {'<ROOT>': 6, '1': 2, '11': 0, '12': 0, '2': 4, '21': 0, '22': 0, '23': 2, '231': 0, '232': 0}),
+    )
+)
+def test_count_leaves_of_tree(build_tree, count_type, expected):
+    assert expected == count_leaves_of_tree(build_tree, count_type=count_type)
+
+
+def test_count_leaves_of_tree_subtree(build_tree):
+    assert {'2': 4, '21': 0, '22': 0, '23': 2, '231': 0, '232': 0} == \
+           count_leaves_of_tree(build_tree, this_level='2', count_type='last')
+
+
+def test_count_future_generations(build_tree):
+    expected = {'<ROOT>': 3, '1': 1, '11': 0, '12': 0, '2': 2, '21': 0, '22': 0, '23': 1, '231': 0, '232': 0}
+    assert expected == count_future_generations(build_tree)
+
+
+@pytest.mark.parametrize(
+    "tree",
+    (
+        {'<ROOT>': ['1', '2'], '1': ['11'], '2': ['11']},
+        {'<ROOT>': ['1', '1']},
+        {'<ROOT>': ['1'], '1': ['<ROOT>']},
+    )
+)
+def test_redundant_tree_raises(tree):
+    with pytest.raises(ValueError):
+        count_leaves_of_tree(tree)
+    with pytest.raises(ValueError):
+        count_future_generations(tree)
+
+
+def test_deep_tree():
+    # Deeper than the default recursion limit
+    depth = 5000
+    tree = {i: [i + 1] for i in range(depth)}
+    leaf_counts = count_leaves_of_tree(tree, this_level=0, count_type='all')
+    assert depth == leaf_counts[0]
+    assert 1 == count_leaves_of_tree(tree, this_level=0, count_type='last')[0]
+    assert depth == count_future_generations(tree, this_level=0)[0]
+
+
+@pytest.fixture
+def build_nested_tree():
+    tree = {
+        '<ROOT>': {
+            '1': {'11': None, '12': None},
+            '2': {'21': None, '22': None, '23': ['231', '232']},
+        },
+    }
+    return tree
+
+
+def _parse_events(obj):
+    """
+    Yields (event, value) pairs for a JSON-like object in the same format as ijson.basic_parse
+    """
+    if isinstance(obj, dict):
+        yield 'start_map', None
+        for key, value in obj.items():
+            yield 'map_key', key
+            yield from _parse_events(value)
+        yield 'end_map', None
+    elif isinstance(obj, list):
+        yield 'start_array', None
+        for value in obj:
+            yield from _parse_events(value)
+        yield 'end_array', None
+    elif obj is None:
+        yield 'null', None
+    else:
+        yield 'string', obj
+
+
+@pytest.mark.parametrize("count_type", ('all', 'first', 'last'))
+def test_count_leaves_of_nested_tree(build_tree, build_nested_tree, count_type):
+    assert count_leaves_of_tree(build_tree, count_type=count_type) == \
+           count_leaves_of_tree(build_nested_tree, count_type=count_type)
+    assert count_leaves_of_tree(build_tree, this_level='2', count_type=count_type) == \
+           count_leaves_of_tree(build_nested_tree['<ROOT>'], this_level='2', count_type=count_type)
+
+
+def test_count_future_generations_nested_tree(build_tree, build_nested_tree):
+    assert count_future_generations(build_tree) == count_future_generations(build_nested_tree)
+
+
+def test_tree_statistics_from_events(build_tree, build_nested_tree):
+    expected = tree_statistics(build_tree).sort_index()
+    stats = tree_statistics_from_events(_parse_events(build_nested_tree))
+    pd.testing.assert_frame_equal(expected, stats.sort_index())
+
+    # Events with a prefix, like ijson.parse
+    stats = tree_statistics_from_events(('', event, value) for event, value in _parse_events(build_nested_tree))
+    pd.testing.assert_frame_equal(expected, stats.sort_index())
+
+
+def test_tree_statistics_from_events_redundant_raises():
+    with pytest.raises(ValueError):
+        tree_statistics_from_events(_parse_events({'<ROOT>': {'1': ['11'], '2': {'11': None}}}))
+
+
+@pytest.mark.parametrize("this_level", ('<ROOT>', '2', '21'))
+def test_tree_statistics(build_tree, this_level):
+    stats = tree_statistics(build_tree, this_level=this_level)
+    for count_type in ('all', 'first', 'last'):
+        assert count_leaves_of_tree(build_tree, this_level=this_level, count_type=count_type) == \
+               stats.loc[:, count_type].to_dict()
+    assert count_future_generations(build_tree, this_level=this_level) == stats.loc[:, 'generations'].to_dict()
+
+
+@pytest.fixture
+def build_dag():
+    dag = {
+        '<ROOT>': ['1', '2'],
+        '1': ['11', '3'],
+        '2': ['3', '21'],
+        '3': ['31', '32'],
+        '32': ['321'],
+        '21': ['321'],
+    }
+    return dag
+
+
+@pytest.mark.parametrize(
+    "count_type, expected",
+    (
+        ('all', {'<ROOT>': 8, '1': 5, '11': 0, '3': 3, '31': 0, '32': 1, '321': 0, '2': 5, '21': 1}),
+        ('first', {'<ROOT>': 2, '1': 2, '11': 0, '3': 2, '31': 0, '32': 1, '321': 0, '2': 2, '21': 1}),
+        ('last', {'<ROOT>': 3, '1': 3, '11': 0, '3': 2, '31': 0, '32': 1, '321': 0, '2': 2, '21': 1}),
+    )
+)
+def test_count_leaves_of_dag(build_dag, count_type, expected):
+    assert expected == count_leaves_of_tree(build_dag, count_type=count_type, dag=True)
+    assert expected == tree_statistics(build_dag, dag=True).loc[:, count_type].to_dict()
+
+
+def test_count_future_generations_dag(build_dag):
+    expected = {'<ROOT>': 4, '1': 3, '11': 0, '3': 2, '31': 0, '32': 1, '321': 0, '2': 3, '21': 1}
+    assert expected == count_future_generations(build_dag, dag=True)
+    with pytest.raises(ValueError):
+        count_future_generations(build_dag)
+
+
+@pytest.mark.parametrize("count_type", ('all', 'first', 'last'))
+def test_dag_mode_matches_tree(build_tree, count_type):
+    assert count_leaves_of_tree(build_tree, count_type=count_type) == \
+           count_leaves_of_tree(build_tree, count_type=count_type, dag=True)
+
+
+def test_dag_cycle_raises():
+    with pytest.raises(ValueError):
+        count_leaves_of_tree({'<ROOT>': ['1'], '1': ['2'], '2': ['1']}, dag=True)
+
+
+def test_dag_heavy_sharing():
+    # Every node shares a child with its sibling, so the number of paths through the graph grows exponentially
+    depth = 2000
+    dag = {i: [i + 1, i + 2] for i in range(depth)}
+    assert depth + 1 == count_leaves_of_tree(dag, this_level=0, count_type='all', dag=True)[0]
+    assert 2 == count_leaves_of_tree(dag, this_level=0, count_type='last', dag=True)[0]
+    assert depth == count_future_generations(dag, this_level=0, dag=True)[0]
+
+
+@pytest.mark.parametrize("count_type", ('all', 'first', 'last'))
+def test_compiled_tree_count_leaves(build_tree, count_type):
+    compiled = CompiledTree(build_tree)
+    assert count_leaves_of_tree(build_tree, count_type=count_type) == \
+           compiled.to_dict(compiled.count_leaves(count_type))
+
+
+def test_compiled_tree_count_future_generations(build_tree):
+    compiled = CompiledTree(build_tree)
+    assert count_future_generations(build_tree) == compiled.to_dict(compiled.count_future_generations())
+
+
+def test_compiled_tree_layout(build_tree):
+    compiled = CompiledTree(build_tree)
+    assert 10 == len(compiled)
+    assert 4 == compiled.n_levels
+    assert 0 == compiled.id_of('<ROOT>')
+    assert np.all(compiled.parents[1:3] == 0)
+    node = compiled.id_of('2')
+    children = compiled.labels[compiled.child_offsets[node]:compiled.child_offsets[node + 1]]
+    assert ['21', '22', '23'] == list(children)
+
+
+def test_compiled_tree_redundant_raises():
+    with pytest.raises(ValueError):
+        CompiledTree({'<ROOT>': ['1', '2'], '1': ['11'], '2': ['11']})
+
+
+def _assert_mutable_tree_matches(mutable_tree):
+    tree = {node: mutable_tree.children(node) for node in mutable_tree.to_dict() if mutable_tree.children(node)}
+    stats = tree_statistics(tree, this_level=mutable_tree.root)
+    assert len(stats) == len(mutable_tree)
+    for node in stats.index:
+        assert stats.loc[node].to_dict() == mutable_tree.statistics(node)
+
+
+def test_mutable_tree_init(build_tree):
+    mutable_tree = MutableTree(build_tree)
+    for count_type in ('all', 'first', 'last'):
+        assert count_leaves_of_tree(build_tree, count_type=count_type) == mutable_tree.to_dict(count_type)
+    assert 3 == mutable_tree.count_future_generations('<ROOT>')
+
+
+def test_mutable_tree_modify(build_tree):
+    mutable_tree = MutableTree(build_tree)
+
+    mutable_tree.add_node('121', '12')
+    _assert_mutable_tree_matches(mutable_tree)
+    assert 6 == mutable_tree.count_leaves('<ROOT>', count_type='last')
+
+    mutable_tree.add_subtree({'3': ['31'], '31': ['311', '312']}, '231', this_level='3')
+    _assert_mutable_tree_matches(mutable_tree)
+    assert 6 == mutable_tree.count_future_generations('<ROOT>')
+
+    mutable_tree.move_node('3', '<ROOT>')
+    _assert_mutable_tree_matches(mutable_tree)
+    assert 3 == mutable_tree.count_future_generations('<ROOT>')
+
+    mutable_tree.remove_node('2')
+    _assert_mutable_tree_matches(mutable_tree)
+    assert '23' not in mutable_tree
+    assert 8 == mutable_tree.count_leaves('<ROOT>', count_type='all')
+
+
+def test_mutable_tree_invalid(build_tree):
+    mutable_tree = MutableTree(build_tree)
+    with pytest.raises(ValueError):
+        mutable_tree.add_node('11', '2')
+    with pytest.raises(ValueError):
+        mutable_tree.move_node('2', '23')
+    with pytest.raises(ValueError):
+        mutable_tree.remove_node('<ROOT>')
+    with pytest.raises(KeyError):
+        mutable_tree.add_node('3', 'not_a_node')
+    _assert_mutable_tree_matches(mutable_tree)
+
+
+@pytest.fixture
+def build_edges(build_tree):
+    edges = [(parent, child) for parent, children in build_tree.items() for child in sorted(children)]
+    return pd.DataFrame(edges, columns=['parent', 'child'])
+
+
+@pytest.mark.parametrize("this_level", ('<ROOT>', '2', '21'))
+def test_compiled_tree_from_dataframe(build_tree, build_edges, this_level):
+    compiled = CompiledTree.from_dataframe(build_edges.iloc[::-1])
+    for count_type in ('all', 'first', 'last'):
+        assert count_leaves_of_tree(build_tree, this_level=this_level, count_type=count_type) == \
+               count_leaves_of_tree(compiled, this_level=this_level, count_type=count_type)
+    assert count_future_generations(build_tree, this_level=this_level) == \
+           count_future_generations(compiled, this_level=this_level)
+    pd.testing.assert_frame_equal(tree_statistics(build_tree, this_level=this_level).sort_index(),
+                                  tree_statistics(compiled, this_level=this_level).sort_index())
+
+
+def test_compiled_tree_from_edges_infer_root():
+    compiled = CompiledTree.from_edges(np.array([10, 1, 1, 0]), np.array([11, 10, 12, 1]), root=None)
+    assert 0 == compiled.root
+    assert [0, 1, 10, 12, 11] == list(compiled.labels)
+    assert [4, 3, 1, 0, 0] == list(compiled.count_leaves('all'))
+
+
+def test_compiled_tree_from_edges_mixed_label_types():
+    # Integer nodes under the default string root keep their type
+    tree = {'<ROOT>': {1: {3: {}}, 2: {}}}
+    compiled = CompiledTree.from_edges(['<ROOT>', '<ROOT>', 1], [1, 2, 3])
+    assert 1 in compiled
+    assert '1' not in compiled
+    for count_type in ('all', 'first', 'last'):
+        assert count_leaves_of_tree(tree, count_type=count_type) == \
+               count_leaves_of_tree(compiled, count_type=count_type)
+
+
+@pytest.mark.parametrize(
+    "parents, children, root",
+    (
+        (['<ROOT>', '<ROOT>', '1', '2'], ['1', '2', '11', '11'], '<ROOT>'),
+        (['<ROOT>', '1'], ['1', '<ROOT>'], '<ROOT>'),
+        (['a', 'b'], ['1', '2'], None),
+    )
+)
+def test_compiled_tree_from_edges_invalid(parents, children, root):
+    with pytest.raises(ValueError):
+        CompiledTree.from_edges(parents, children, root=root)